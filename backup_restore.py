@@ -1,48 +1,476 @@
 import os
+import gzip
+import json
+import lzma
+import hashlib
+import asyncio
+import sqlite3
 import zipfile
 import shutil
 import datetime
+from typing import Dict, List, Optional, Tuple
 from telegram.ext import ContextTypes
 import db
 
-def create_backup_zip(zip_name: str = "backup.zip") -> str:
-    db_path = db.DB_PATH
-    if not os.path.exists(db_path):
-        return ""
-    with zipfile.ZipFile(zip_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        zipf.write(db_path, arcname="database.db")
-    return zip_name
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BACKUP_STEP_PAGES = int(os.getenv("BACKUP_STEP_PAGES", "256"))
+BACKUP_STEP_SLEEP = 0.005
+BACKUP_FULL_EVERY = int(os.getenv("BACKUP_FULL_EVERY", "168"))
+DELTA_SUFFIX = ".delta.gz"
+DELTA_FETCH = 500
+# Bot 50 MB gacha yuboradi, lekin 20 MB gacha yuklab oladi: qismlar bot orqali tiklanishi uchun 19 MB
+BACKUP_PART_SIZE = int(os.getenv("BACKUP_PART_SIZE", str(19 * 1024 * 1024)))
+BACKUP_ZSTD_LEVEL = int(os.getenv("BACKUP_ZSTD_LEVEL", "10"))
+ARCHIVE_CHUNK = 1024 * 1024
+MANIFEST_SUFFIX = ".manifest.json"
+
+class BackupError(Exception):
+    pass
+
+def snapshot_db(dest_path: str):
+    # SQLite backup API: kichik qadamlar bilan izchil nusxa, yozuvchilar bloklanmaydi
+    db.flush_writes()
+    src = sqlite3.connect(db.DB_PATH)
+    dst = sqlite3.connect(dest_path)
+    try:
+        src.backup(dst, pages=BACKUP_STEP_PAGES, sleep=BACKUP_STEP_SLEEP)
+    finally:
+        dst.close()
+        src.close()
+
+# Inkremental zanjir holati: backup_state (chain_id, seq, ...) va har jadval uchun rowid belgisi
+def _get_state(c: sqlite3.Cursor) -> Dict[str, str]:
+    c.execute("SELECT key, value FROM backup_state")
+    return {r[0]: r[1] for r in c.fetchall()}
+
+def _set_state(c: sqlite3.Cursor, **values):
+    c.executemany("INSERT OR REPLACE INTO backup_state (key, value) VALUES (?, ?)", [(k, str(v)) for k, v in values.items()])
+
+def _read_marks(c: sqlite3.Cursor) -> Tuple[Dict[str, int], int]:
+    marks = {}
+    for table, monotonic in db.journal_tables(c):
+        if monotonic:
+            c.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}")
+            marks[table] = c.fetchone()[0]
+    c.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log")
+    return marks, c.fetchone()[0]
+
+def _save_marks(c: sqlite3.Cursor, marks: Dict[str, int], last_seq: int):
+    c.execute("DELETE FROM backup_marks")
+    c.executemany("INSERT INTO backup_marks (tbl, last_rowid) VALUES (?, ?)", list(marks.items()))
+    c.execute("DELETE FROM change_log WHERE seq <= ?", (last_seq,))
+
+def _start_chain(snapshot: str):
+    # Belgilar snapshotning o'zidan o'qiladi: nusxa va belgilar orasida o'zgarish yo'qolmaydi
+    chain_id = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    snap = sqlite3.connect(snapshot)
+    snap.row_factory = sqlite3.Row
+    try:
+        c = snap.cursor()
+        marks, last_seq = _read_marks(c)
+        schema = db.get_schema_version(snap)
+        _set_state(c, chain_id=chain_id, seq=0)
+        snap.commit()
+    finally:
+        snap.close()
+    with db.get_connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        _save_marks(c, marks, last_seq)
+        _set_state(c, chain_id=chain_id, seq=0, last_seq=last_seq, schema=schema, force_full=0)
+
+# Siqish: zstandard o'rnatilgan bo'lsa zstd, aks holda stdlib lzma
+def _compressor(codec: str):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=BACKUP_ZSTD_LEVEL, threads=-1).compressobj()
+    return lzma.LZMACompressor(preset=6)
+
+def _decompressor(codec: str):
+    if codec == "zstd":
+        if zstandard is None:
+            raise BackupError("zstd arxivi uchun zstandard paketi kerak")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return lzma.LZMADecompressor()
+
+class _PartWriter:
+    # Siqilgan oqimni belgilangan o'lchamdagi raqamlangan qismlarga bo'ladi
+    def __init__(self, base: str, part_size: int):
+        self.base = base
+        self.part_size = part_size
+        self.parts: List[Dict] = []
+        self._file = None
+        self._hash = None
+        self._size = 0
+
+    def _roll(self):
+        self._close_part()
+        name = f"{self.base}.part{len(self.parts) + 1:03d}"
+        self._file = open(name, "wb")
+        self._hash = hashlib.sha256()
+        self._size = 0
+        self.parts.append({"name": os.path.basename(name), "path": name})
+
+    def _close_part(self):
+        if self._file is not None:
+            self._file.close()
+            self.parts[-1].update(size=self._size, sha256=self._hash.hexdigest())
+            self._file = None
+
+    def write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            if self._file is None or self._size >= self.part_size:
+                self._roll()
+            n = min(len(view), self.part_size - self._size)
+            self._file.write(view[:n])
+            self._hash.update(view[:n])
+            self._size += n
+            view = view[n:]
+
+    def close(self):
+        if self._file is None and not self.parts:
+            self._roll()
+        self._close_part()
+
+def create_backup_archive(base: str, start_chain: bool = False) -> List[str]:
+    # Snapshot -> oqimli siqish -> qismlar + sha256 manifest. Oxirgi element manifest.
+    # Zanjir faqat rejali to'liq backupda yangilanadi: qo'lda olingan nusxa delta belgilariga tegmaydi
+    if not os.path.exists(db.DB_PATH):
+        return []
+    snapshot = f"{base}.snapshot.db"
+    codec = "zstd" if zstandard is not None else "xz"
+    writer = _PartWriter(base, BACKUP_PART_SIZE)
+    try:
+        snapshot_db(snapshot)
+        if start_chain:
+            _start_chain(snapshot)
+        comp = _compressor(codec)
+        digest, size = hashlib.sha256(), 0
+        with open(snapshot, "rb") as f:
+            while chunk := f.read(ARCHIVE_CHUNK):
+                digest.update(chunk)
+                size += len(chunk)
+                writer.write(comp.compress(chunk))
+        writer.write(comp.flush())
+        writer.close()
+    except Exception:
+        writer.close()
+        for p in writer.parts:
+            if os.path.exists(p["path"]):
+                os.remove(p["path"])
+        raise
+    finally:
+        if os.path.exists(snapshot):
+            os.remove(snapshot)
+    manifest = {
+        "type": "kino_backup",
+        "codec": codec,
+        "size": size,
+        "sha256": digest.hexdigest(),
+        "parts": [{k: p[k] for k in ("name", "size", "sha256")} for p in writer.parts],
+    }
+    manifest_path = f"{base}{MANIFEST_SUFFIX}"
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    return [p["path"] for p in writer.parts] + [manifest_path]
+
+async def _send_files(bot, chat_id: int, paths: List[str], caption: str):
+    # Qismlar ketma-ket yuboriladi, manifest oxirida; fayllar har holda o'chiriladi
+    try:
+        for i, path in enumerate(paths, 1):
+            text = caption if len(paths) == 1 else f"{caption}\n🧩 {i}/{len(paths)}"
+            with open(path, "rb") as f:
+                await bot.send_document(chat_id=chat_id, document=f, filename=os.path.basename(path), caption=text, parse_mode="HTML")
+    finally:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+async def send_backup(bot, chat_id: int, caption: str, base: str = "backup"):
+    # Snapshot va siqish alohida threadda: event loop bo'sh qoladi
+    paths = await asyncio.to_thread(create_backup_archive, base)
+    if paths:
+        await _send_files(bot, chat_id, paths, caption)
+
+def _rowid_aliased(c: sqlite3.Cursor, table: str) -> bool:
+    # INTEGER PRIMARY KEY bo'lsa rowid shu ustun bilan bir xil
+    c.execute(f"PRAGMA table_info({table})")
+    pks = [r for r in c.fetchall() if r["pk"]]
+    return len(pks) == 1 and pks[0]["type"].upper() == "INTEGER"
+
+def _row_op(table: str, row, aliased: bool) -> str:
+    data = dict(row)
+    rowid = data.pop("__rowid__")
+    if not aliased:
+        data["rowid"] = rowid
+    return json.dumps({"t": table, "op": "u", "r": data}, ensure_ascii=False)
+
+def needs_full_backup() -> bool:
+    with db.get_connection() as conn:
+        state = _get_state(conn.cursor())
+        return (
+            not state.get("chain_id")
+            or state.get("force_full") == "1"
+            or int(state.get("seq", 0)) >= BACKUP_FULL_EVERY
+            or state.get("schema") != str(db.get_schema_version(conn))
+        )
+
+def create_delta(path: str) -> Optional[int]:
+    # Oxirgi backupdan beri o'zgargan qatorlar: yangi rowid lar + change_log dagi yozuvlar
+    # Zanjir yo'q bo'lsa None, o'zgarish bo'lmasa 0 qaytadi (fayl yaratilmaydi)
+    db.flush_writes()
+    with db.get_connection() as conn:
+        c = conn.cursor()
+        state = _get_state(c)
+        if not state.get("chain_id"):
+            return None
+        c.execute("SELECT tbl, last_rowid FROM backup_marks")
+        old_marks = {r[0]: r[1] for r in c.fetchall()}
+        last_seq = int(state.get("last_seq", 0))
+        seq = int(state.get("seq", 0)) + 1
+        count = 0
+        conn.execute("BEGIN")
+        try:
+            marks, new_seq = _read_marks(c)
+            with gzip.open(path, "wt", encoding="utf-8") as f:
+                f.write(json.dumps({"type": "kino_delta", "chain": state["chain_id"], "seq": seq, "schema": db.get_schema_version(conn)}) + "\n")
+                for table, monotonic in db.journal_tables(c):
+                    aliased = _rowid_aliased(c, table)
+                    if monotonic:
+                        c.execute(f"SELECT rowid AS __rowid__, * FROM {table} WHERE rowid > ? AND rowid <= ?", (old_marks.get(table, 0), marks[table]))
+                        for row in c.fetchall():
+                            f.write(_row_op(table, row, aliased) + "\n")
+                            count += 1
+                    c.execute("SELECT DISTINCT row_id FROM change_log WHERE tbl = ? AND seq > ? AND seq <= ?", (table, last_seq, new_seq))
+                    changed = [r[0] for r in c.fetchall() if not monotonic or r[0] <= old_marks.get(table, 0)]
+                    for i in range(0, len(changed), DELTA_FETCH):
+                        ids = changed[i:i + DELTA_FETCH]
+                        c.execute(f"SELECT rowid AS __rowid__, * FROM {table} WHERE rowid IN ({','.join('?' * len(ids))})", ids)
+                        found = set()
+                        for row in c.fetchall():
+                            found.add(row["__rowid__"])
+                            f.write(_row_op(table, row, aliased) + "\n")
+                        for rowid in ids:
+                            if rowid not in found:
+                                f.write(json.dumps({"t": table, "op": "d", "id": rowid}) + "\n")
+                        count += len(ids)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        if not count:
+            os.remove(path)
+            return 0
+        c.execute("BEGIN IMMEDIATE")
+        _save_marks(c, marks, new_seq)
+        _set_state(c, seq=seq, last_seq=new_seq)
+    return count
+
+def apply_delta(file_path: str) -> int:
+    # Delta faqat o'z zanjiridagi bazaga va ketma-ket (seq = joriy + 1) qo'llanadi
+    with gzip.open(file_path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("type") != "kino_delta":
+            raise BackupError("Delta fayl emas")
+        with db.get_connection() as conn:
+            c = conn.cursor()
+            state = _get_state(c)
+            if state.get("chain_id") != header["chain"]:
+                raise BackupError(f"Delta boshqa zanjirga tegishli ({header['chain']})")
+            if int(state.get("seq", 0)) != header["seq"] - 1:
+                raise BackupError(f"Delta #{header['seq']} kutilmagan (joriy: #{state.get('seq', 0)})")
+            if db.get_schema_version(conn) != header["schema"]:
+                raise BackupError("Sxema versiyasi mos emas")
+            c.execute("BEGIN IMMEDIATE")
+            count = 0
+            for line in f:
+                op = json.loads(line)
+                if op["op"] == "d":
+                    c.execute(f"DELETE FROM {op['t']} WHERE rowid = ?", (op["id"],))
+                else:
+                    cols = list(op["r"])
+                    c.execute(
+                        f"INSERT OR REPLACE INTO {op['t']} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                        [op["r"][k] for k in cols]
+                    )
+                count += 1
+            # Tiklangan bazadan keyingi backup to'liq bo'ladi
+            _set_state(c, seq=header["seq"], force_full=1)
+    return count
+
+class _PartsReader:
+    # Qismlarni ketma-ket o'qiydi va har birining sha256 ini tekshiradi
+    def __init__(self, directory: str, parts: List[Dict]):
+        self.directory = directory
+        self.parts = parts
+
+    def _read(self, part):
+        with open(os.path.join(self.directory, part["name"]), "rb") as f:
+            while chunk := f.read(ARCHIVE_CHUNK):
+                yield chunk
+
+    def verify(self):
+        for part in self.parts:
+            path = os.path.join(self.directory, part["name"])
+            if not os.path.exists(path) or os.path.getsize(path) != part["size"]:
+                raise BackupError(f"Qism yo'q yoki hajmi noto'g'ri: {part['name']}")
+            digest = hashlib.sha256()
+            for chunk in self._read(part):
+                digest.update(chunk)
+            if digest.hexdigest() != part["sha256"]:
+                raise BackupError(f"Checksum mos emas: {part['name']}")
+
+    def chunks(self):
+        for part in self.parts:
+            yield from self._read(part)
+
+def unpack_archive(manifest_path: str, dest_path: str):
+    # Manifest bo'yicha qismlar yig'iladi; butun arxiv xotirada saqlanmaydi
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get("type") != "kino_backup":
+        raise BackupError("Backup manifesti emas")
+    reader = _PartsReader(os.path.dirname(os.path.abspath(manifest_path)), manifest["parts"])
+    reader.verify()
+    decomp = _decompressor(manifest["codec"])
+    digest, size = hashlib.sha256(), 0
+    try:
+        with open(dest_path, "wb") as out:
+            for chunk in reader.chunks():
+                data = decomp.decompress(chunk)
+                digest.update(data)
+                size += len(data)
+                out.write(data)
+        if size != manifest["size"] or digest.hexdigest() != manifest["sha256"]:
+            raise BackupError("Tiklangan baza checksum i mos emas")
+    except Exception:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+
+# Tiklash: staging -> tekshiruv -> atomik almashtirish -> migratsiya va keshlarni tozalash
+def _stage(file_path: str, staged: str) -> bool:
+    if file_path.endswith(MANIFEST_SUFFIX):
+        unpack_archive(file_path, staged)
+    elif file_path.endswith(".zip"):
+        with zipfile.ZipFile(file_path, 'r') as zipf, zipf.open("database.db") as src, open(staged, "wb") as dst:
+            shutil.copyfileobj(src, dst, ARCHIVE_CHUNK)
+    elif file_path.endswith(".db"):
+        shutil.copyfile(file_path, staged)
+    else:
+        return False
+    return True
+
+def validate_db(path: str) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        result = [r[0] for r in conn.execute("PRAGMA integrity_check").fetchall()]
+        if result != ["ok"]:
+            raise BackupError("integrity_check: " + "; ".join(result[:5]))
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = {"users", "movies", "settings"} - tables
+        if missing:
+            raise BackupError(f"Jadvallar yo'q: {', '.join(sorted(missing))}")
+        version = db.get_schema_version(conn) if "schema_version" in tables else 0
+        if version > db.MIGRATIONS[-1][0]:
+            raise BackupError(f"Backup sxemasi (v{version}) bu koddan yangiroq")
+        # Staging fayl WAL siz, bitta faylda qoladi
+        conn.execute("PRAGMA journal_mode=DELETE")
+        return version
+    finally:
+        conn.close()
+
+def _fsync_dir(path: str):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def install_db(staged: str):
+    # Ulanishlar bo'shatiladi, eski WAL o'chiriladi va fayl bitta rename bilan almashtiriladi
+    db.flush_writes()
+    with db.paused_pool():
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(db.DB_PATH + suffix):
+                os.remove(db.DB_PATH + suffix)
+        os.replace(staged, db.DB_PATH)
+        _fsync_dir(db.DB_PATH)
+    db.init_db()
+    db.reset_caches()
+    db.load_catalog()
+    with db.get_connection() as conn:
+        _set_state(conn.cursor(), force_full=1)
 
 def restore_from_file(file_path: str) -> bool:
+    staged = f"{db.DB_PATH}.restore"
     try:
-        if file_path.endswith(".zip"):
-            with zipfile.ZipFile(file_path, 'r') as zipf:
-                zipf.extract("database.db", ".")
-            return True
-        elif file_path.endswith(".db"):
-            shutil.copyfile(file_path, db.DB_PATH)
+        if file_path.endswith(DELTA_SUFFIX):
+            apply_delta(file_path)
+            db.reset_caches()
             return True
+        if not _stage(file_path, staged):
+            return False
+        validate_db(staged)
+        install_db(staged)
+        return True
     except Exception as e:
         print(f"Restore xatosi: {e}")
         return False
-    return False
+    finally:
+        for path in (staged, staged + "-wal", staged + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+def restore_chain(base_path: str, delta_paths: List[str]) -> bool:
+    # To'liq snapshot + deltalar seq tartibida
+    if not restore_from_file(base_path):
+        return False
+    return all(restore_from_file(p) for p in delta_paths)
+
+def create_scheduled_backup(stamp: str) -> Tuple[str, List[str]]:
+    # Zanjir yangi yoki uzun bo'lsa to'liq snapshot, aks holda delta
+    if not needs_full_backup():
+        path = f"backup_{stamp}{DELTA_SUFFIX}"
+        count = create_delta(path)
+        if count == 0:
+            return "empty", []
+        if count is not None:
+            return "delta", [path]
+    return "full", create_backup_archive(f"backup_{stamp}", start_chain=True)
 
 async def auto_backup_job(context: ContextTypes.DEFAULT_TYPE):
     main_admin = context.bot_data.get("MAIN_ADMIN")
     if not main_admin:
         return
-    zip_name = f"backup_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-    created = create_backup_zip(zip_name)
-    if created and os.path.exists(created):
-        try:
-            with open(created, "rb") as doc:
-                await context.bot.send_document(
-                    chat_id=main_admin,
-                    document=doc,
-                    caption=f"📦 <b>Avtomatik Zaxira (Backup)</b>\nSana: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}",
-                    parse_mode="HTML"
-                )
-            os.remove(created)
-        except Exception as e:
-            print(f"Backup yuborishda xatolik: {e}")
-            
\ No newline at end of file
+    now = datetime.datetime.now()
+    try:
+        kind, paths = await asyncio.to_thread(create_scheduled_backup, now.strftime('%Y%m%d_%H%M%S'))
+        if not paths:
+            return
+        title = "Avtomatik Zaxira (Backup)" if kind == "full" else "Inkremental Zaxira (Delta)"
+        await _send_files(context.bot, main_admin, paths, f"📦 <b>{title}</b>\nSana: {now.strftime('%Y-%m-%d %H:%M')}")
+    except Exception as e:
+        print(f"Backup yuborishda xatolik: {e}")
+
+if __name__ == "__main__":
+    # Qo'lda tiklash: python backup_restore.py <manifest|.db|.zip> [delta ...]
+    import sys
+    if len(sys.argv) < 2:
+        print("Foydalanish: python backup_restore.py <backup> [delta ...]")
+        sys.exit(2)
+    db.DB_PATH = os.getenv("DB_PATH", "database.db")
+    ok = restore_chain(sys.argv[1], sys.argv[2:])
+    db.shutdown()
+    sys.exit(0 if ok else 1)
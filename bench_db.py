@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import datetime
+import platform
+from typing import Any, Callable, Dict, List, Tuple
+
+import db
+import timeutil
+
+# Sintetik DB hajmlari: prod = ishlab chiqarishdagi taxminiy hajm
+SCALES = {
+    "small": dict(users=10_000, movies=2_000, history=200_000, ratings=50_000),
+    "medium": dict(users=100_000, movies=10_000, history=2_000_000, ratings=500_000),
+    "prod": dict(users=1_000_000, movies=50_000, history=20_000_000, ratings=5_000_000),
+}
+LOAD_CHUNK = 50_000
+NAMES = ("Avatar", "Titanik", "Qasoskorlar", "Shrek", "Matritsa", "Interstellar", "Joker", "Gladiator", "Inception", "Dune",
+         "O'tkan kunlar", "Mehrobdan chayon", "Shum bola", "Abdullajon", "Yulduzlar jangi", "Hobbit", "Mumiya", "Tarzan")
+
+def _chunks(rows, size: int = LOAD_CHUNK):
+    buf = []
+    for row in rows:
+        buf.append(row)
+        if len(buf) >= size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+def _stamp(base: int, seconds: int) -> int:
+    return base + seconds
+
+def _codes(movies: int) -> List[Tuple[str, int]]:
+    # Har kodda 1-4 qism, jami qismlar soni = movies
+    rnd, out, code = random.Random(1), [], 1000
+    while len(out) < movies:
+        code += 1
+        for part in range(1, rnd.randint(1, 4) + 1):
+            out.append((str(code), part))
+    return out[:movies]
+
+def generate(path: str, users: int, movies: int, history: int, ratings: int, favorites: int, subscriptions: int):
+    if os.path.exists(path):
+        os.remove(path)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    db.DB_PATH = path
+    db.init_db()
+    db.shutdown()
+
+    rnd = random.Random(42)
+    now = timeutil.now()
+    year_ago = now - timeutil.days(365)
+    parts = _codes(movies)
+    codes = sorted({c for c, _ in parts}, key=int)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous=OFF")
+    # Jurnal triggerlari yuklash paytida o'chiriladi, init_db ularni qayta yaratadi
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_journal_%'").fetchall():
+        conn.execute(f"DROP TRIGGER {name}")
+
+    def load(label: str, sql: str, rows, total: int):
+        start, done = time.perf_counter(), 0
+        for chunk in _chunks(rows):
+            conn.executemany(sql, chunk)
+            conn.commit()
+            done += len(chunk)
+            print(f"\r  {label}: {done}/{total}", end="", flush=True)
+        print(f"\r  {label}: {total} ({time.perf_counter() - start:.1f}s)")
+
+    load("users", "INSERT INTO users (id, username, full_name, is_blocked, join_date) VALUES (?, ?, ?, ?, ?)",
+         ((100_000 + i, f"user{i}", f"Foydalanuvchi {i}", int(rnd.random() < 0.01), _stamp(year_ago, rnd.randrange(365 * 86400)))
+          for i in range(users)), users)
+    load("movies", "INSERT INTO movies (code, name, quality, year, language, rating, file_id, request_count, part) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+         ((code, f"{NAMES[int(code) % len(NAMES)]} {int(code) // len(NAMES)}", rnd.choice(("480p", "720p", "1080p")), str(rnd.randint(1970, 2024)),
+           rnd.choice(("O'zbek", "Rus", "Ingliz")), 5.0, f"file_{code}_{part}", rnd.randrange(5000), part) for code, part in parts), movies)
+    load("subscriptions", "INSERT INTO subscriptions (user_id, plan_type, start_date, end_date, status) VALUES (?, ?, ?, ?, 'active')",
+         ((100_000 + rnd.randrange(users), m, _stamp(now, -d * 86400), _stamp(now, (m * 30 - d) * 86400))
+          for m, d in ((rnd.choice((1, 3, 6)), rnd.randrange(200)) for _ in range(subscriptions))), subscriptions)
+    load("user_watch_history", "INSERT INTO user_watch_history (user_id, movie_code, watched_at) VALUES (?, ?, ?)",
+         ((100_000 + rnd.randrange(users), rnd.choice(codes), _stamp(year_ago, rnd.randrange(365 * 86400))) for _ in range(history)), history)
+    # (user_id, movie_code) juftliklari takrorlanmasligi uchun deterministik taqsimot
+    load("movie_ratings", "INSERT INTO movie_ratings (user_id, movie_code, rating, rated_at) VALUES (?, ?, ?, ?)",
+         ((100_000 + i % users, codes[(i // users + i * 7) % len(codes)], rnd.randint(1, 5), _stamp(year_ago, rnd.randrange(365 * 86400)))
+          for i in range(min(ratings, users * len(codes)))), ratings)
+    load("favorites", "INSERT OR IGNORE INTO favorites (user_id, movie_code, added_at) VALUES (?, ?, ?)",
+         ((100_000 + i % users, codes[(i // users + i * 13) % len(codes)], _stamp(year_ago, rnd.randrange(365 * 86400)))
+          for i in range(min(favorites, users * len(codes)))), favorites)
+
+    conn.close()
+    # Statistika va reyting agregatlari jadvallardan qayta hisoblanadi
+    db.init_db()
+    db.rebuild_stats()
+    db.rebuild_rating_aggregates()
+    with db.get_connection() as conn:
+        conn.execute("ANALYZE")
+    db.shutdown()
+
+# Benchmarklar: (nom, funksiya, argumentlar generatori)
+def benchmarks(rnd: random.Random) -> List[Tuple[str, Callable, Callable[[], tuple]]]:
+    with db.get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT MIN(id), MAX(id) FROM users")
+        lo, hi = c.fetchone()
+        c.execute("SELECT DISTINCT code FROM movies")
+        codes = [r[0] for r in c.fetchall()]
+        c.execute("SELECT MAX(id) FROM movies")
+        max_movie = c.fetchone()[0]
+    user = lambda: rnd.randint(lo, hi)
+    code = lambda: rnd.choice(codes)
+    words = [n.split()[0].lower() for n in NAMES]
+    return [
+        ("get_movies_by_code", db.get_movies_by_code, lambda: (code(),)),
+        ("get_movie_by_id", db.get_movie_by_id, lambda: (rnd.randint(1, max_movie),)),
+        ("search_movies_by_name", db.search_movies_by_name, lambda: (rnd.choice(words)[:rnd.randint(3, 6)],)),
+        ("get_rating", db.get_rating, lambda: (code(),)),
+        ("get_movies_after", db.get_movies_after, lambda: (rnd.randint(0, max_movie), 200)),
+        ("get_user_subscription", db.get_user_subscription, lambda: (user(),)),
+        ("has_active_subscription", db.has_active_subscription, lambda: (user(), 0)),
+        ("is_user_blocked", db.is_user_blocked, lambda: (user(),)),
+        ("get_setting", db.get_setting, lambda: ("referral_reward_type",)),
+        ("get_mandatory_channels", db.get_mandatory_channels, lambda: ()),
+        # Profil "📈 Statistika", sevimlilar ro'yxati va admin statistika markazi
+        ("get_user_stats", db.get_user_stats, lambda: (user(),)),
+        ("get_favorites", db.get_favorites, lambda: (user(),)),
+        ("get_bot_stats", db.get_bot_stats, lambda: ()),
+        ("add_user", db.add_user, lambda: (user(), "bench", "Bench User")),
+        ("add_rating", db.add_rating, lambda: (user(), code(), rnd.randint(1, 5))),
+        ("add_favorite", db.add_favorite, lambda: (user(), code())),
+        ("add_watch_history", db.add_watch_history, lambda: (user(), code())),
+        ("add_days_subscription", db.add_days_subscription, lambda: (user(), 3)),
+        ("get_next_movie_code", db.get_next_movie_code, lambda: ()),
+    ]
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+def measure(func: Callable, args: Callable[[], tuple], iterations: int, warmup: int) -> Dict[str, float]:
+    for _ in range(warmup):
+        func(*args())
+    samples = []
+    for _ in range(iterations):
+        a = args()
+        start = time.perf_counter()
+        func(*a)
+        samples.append(time.perf_counter() - start)
+    total = sum(samples)
+    samples.sort()
+    return {
+        "n": iterations,
+        "p50_ms": _percentile(samples, 0.50) * 1000,
+        "p99_ms": _percentile(samples, 0.99) * 1000,
+        "mean_ms": total / iterations * 1000,
+        "ops_s": iterations / total if total else 0.0,
+    }
+
+def run(path: str, iterations: int, warmup: int, only: List[str]) -> Dict[str, Any]:
+    db.DB_PATH = path
+    db.init_db()
+    results: Dict[str, Dict[str, float]] = {}
+    # Sovuq start: katalog va qidiruv indeksini yuklash
+    for name, func in (("load_catalog", db.load_catalog), ("search_index_build", lambda: (db._search_index.clear(), db.search_movies_by_name("a")))):
+        if only and name not in only:
+            continue
+        results[name] = measure(func, lambda: (), max(1, iterations // 100), 0)
+        print(_row(name, results[name]))
+    for name, func, args in benchmarks(random.Random(7)):
+        if only and name not in only:
+            continue
+        results[name] = measure(func, args, iterations, warmup)
+        print(_row(name, results[name]))
+    db.flush_writes()
+    with db.get_connection() as conn:
+        counts = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ("users", "movies", "user_watch_history", "movie_ratings", "favorites", "subscriptions")}
+    db.shutdown()
+    return {
+        "meta": {
+            "created": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "iterations": iterations,
+            "rows": counts,
+        },
+        "results": results,
+    }
+
+def _row(name: str, r: Dict[str, float]) -> str:
+    return f"{name:<24} p50 {r['p50_ms']:9.3f}ms  p99 {r['p99_ms']:9.3f}ms  {r['ops_s']:11.1f} ops/s"
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    # p50 yoki p99 threshold foizdan ko'proq oshsa regressiya
+    regressions = []
+    print(f"\nBaseline bilan solishtirish ({baseline['meta'].get('created', '?')}, chegara {threshold:.0f}%):")
+    for name, cur in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<24} (baseline da yo'q)")
+            continue
+        deltas = {k: (cur[k] / base[k] - 1) * 100 if base[k] else 0.0 for k in ("p50_ms", "p99_ms")}
+        bad = [k for k, d in deltas.items() if d > threshold]
+        mark = "  REGRESSIYA" if bad else ""
+        print(f"{name:<24} p50 {deltas['p50_ms']:+7.1f}%  p99 {deltas['p99_ms']:+7.1f}%{mark}")
+        if bad:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="db.py uchun mikro-benchmark")
+    parser.add_argument("--db", default="bench.db", help="sintetik DB fayli")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--movies", type=int, help="kino qismlari soni")
+    parser.add_argument("--history", type=int)
+    parser.add_argument("--ratings", type=int)
+    parser.add_argument("--favorites", type=int)
+    parser.add_argument("--subscriptions", type=int)
+    parser.add_argument("--generate", action="store_true", help="DB ni qayta yaratish (fayl bo'lmasa avtomatik)")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--only", nargs="*", default=[], help="faqat shu benchmarklar")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", help="solishtirish uchun oldingi natijalar JSON")
+    parser.add_argument("--save-baseline", action="store_true", help="natijalarni --baseline fayliga yozish")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regressiya chegarasi, foiz")
+    args = parser.parse_args()
+
+    if args.generate or not os.path.exists(args.db):
+        size = dict(SCALES[args.scale])
+        for key in size:
+            if getattr(args, key) is not None:
+                size[key] = getattr(args, key)
+        size["favorites"] = args.favorites if args.favorites is not None else size["ratings"] // 5
+        size["subscriptions"] = args.subscriptions if args.subscriptions is not None else size["users"] // 5
+        print(f"Sintetik DB yaratilmoqda: {args.db} {size}")
+        start = time.perf_counter()
+        generate(args.db, **size)
+        print(f"Tayyor: {time.perf_counter() - start:.1f}s")
+
+    current = run(args.db, args.iterations, args.warmup, args.only)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(current, f, indent=2, ensure_ascii=False)
+    print(f"\nNatijalar: {args.out}")
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2, ensure_ascii=False)
+        print(f"Baseline saqlandi: {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(current, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
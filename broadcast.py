@@ -0,0 +1,135 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List
+
+from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError, TelegramError
+
+import db
+from ratelimit import TokenBucket
+
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", "500"))
+PROGRESS_INTERVAL = 5
+MAX_RETRIES = 3
+NETWORK_BACKOFF = 1.0
+
+logger = logging.getLogger(__name__)
+
+# Umumiy token bucket: oddiy javoblar uchun Telegram limitidan joy qoladi
+bucket = TokenBucket(BROADCAST_RATE)
+_tasks: Dict[int, asyncio.Task] = {}
+
+async def _send(bot, b, user_id: int) -> str:
+    for attempt in range(MAX_RETRIES):
+        await bucket.acquire()
+        try:
+            await bot.copy_message(chat_id=user_id, from_chat_id=b["from_chat_id"], message_id=b["message_id"])
+            return "sent"
+        except RetryAfter as e:
+            bucket.pause(e.retry_after)
+        except Forbidden:
+            return "blocked"
+        except BadRequest as e:
+            if "chat not found" in str(e).lower():
+                return "blocked"
+            return "failed"
+        except NetworkError as e:
+            # Vaqtinchalik tarmoq xatosi (TimedOut ham): kutib qayta urinish, oxirida failed
+            if attempt == MAX_RETRIES - 1:
+                logger.warning(f"Broadcast {b['id']} -> {user_id}: {e}")
+                return "failed"
+            await asyncio.sleep(NETWORK_BACKOFF * 2 ** attempt)
+        except TelegramError as e:
+            logger.warning(f"Broadcast {b['id']} -> {user_id}: {e}")
+            return "failed"
+    return "failed"
+
+async def _send_batch(bot, b, user_ids: List[int]) -> Dict[str, List[int]]:
+    results = {"sent": [], "failed": [], "blocked": []}
+    pending = iter(user_ids)
+
+    async def worker():
+        for uid in pending:
+            results[await _send(bot, b, uid)].append(uid)
+
+    await asyncio.gather(*[worker() for _ in range(BROADCAST_WORKERS)])
+    return results
+
+def _progress_text(b, sent: int, failed: int, blocked: int, done: bool = False) -> str:
+    head = "✅ <b>Xabar yuborish tugadi</b>" if done else "📤 <b>Xabar yuborilmoqda...</b>"
+    return (
+        f"{head} (#{b['id']})\n\n"
+        f"👥 Jami: {b['total']}\n"
+        f"✅ Yuborildi: {sent}\n"
+        f"❌ Xato: {failed}\n"
+        f"⛔ Botni bloklagan: {blocked}"
+    )
+
+async def _update_progress(bot, b, text: str):
+    if not b["progress_message_id"]:
+        return
+    try:
+        await bot.edit_message_text(text, chat_id=b["admin_id"], message_id=b["progress_message_id"], parse_mode="HTML")
+    except TelegramError:
+        pass
+
+async def _run(bot, broadcast_id: int):
+    b = await db.aget_broadcast(broadcast_id)
+    cursor = b["last_user_id"]
+    sent, failed, blocked = b["sent"], b["failed"], b["blocked"]
+    last_report = 0.0
+    try:
+        while True:
+            user_ids = await db.aget_broadcast_targets(cursor, BROADCAST_BATCH)
+            if not user_ids:
+                break
+            results = await _send_batch(bot, b, user_ids)
+            cursor = user_ids[-1]
+            await db.asave_broadcast_progress(broadcast_id, cursor, len(results["sent"]), results["failed"], results["blocked"])
+            sent += len(results["sent"])
+            failed += len(results["failed"])
+            blocked += len(results["blocked"])
+            if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                await _update_progress(bot, b, _progress_text(b, sent, failed, blocked))
+        await db.afinish_broadcast(broadcast_id, "done")
+        await _update_progress(bot, b, _progress_text(b, sent, failed, blocked, done=True))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Broadcast {broadcast_id} xatosi: {e}")
+    finally:
+        _tasks.pop(broadcast_id, None)
+
+def _spawn(bot, broadcast_id: int):
+    _tasks[broadcast_id] = asyncio.create_task(_run(bot, broadcast_id))
+
+async def start_broadcast(bot, admin_id: int, from_chat_id: int, message_id: int, progress_message_id: int) -> int:
+    broadcast_id = await db.acreate_broadcast(admin_id, from_chat_id, message_id, progress_message_id)
+    _spawn(bot, broadcast_id)
+    return broadcast_id
+
+async def resume_broadcasts(bot):
+    # Restartdan keyin to'xtagan joyidan davom etadi
+    for b in await db.aget_running_broadcasts():
+        if b["id"] not in _tasks:
+            logger.info(f"Broadcast {b['id']} davom ettirilmoqda (user_id > {b['last_user_id']})")
+            _spawn(bot, b["id"])
+
+async def cancel_broadcast(broadcast_id: int) -> bool:
+    task = _tasks.pop(broadcast_id, None)
+    if task is None:
+        return False
+    task.cancel()
+    await db.afinish_broadcast(broadcast_id, "cancelled")
+    return True
+
+async def stop_all():
+    # Shutdown: vazifalar to'xtatiladi, status 'running' qoladi va keyingi startda davom etadi
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,85 @@
+import threading
+from typing import Dict, List, Optional
+
+class MovieRecord:
+    __slots__ = ("id", "code", "name", "quality", "year", "language", "rating", "file_id", "part")
+
+    def __init__(self, id: int, code: str, name: str, quality: str, year: str, language: str, rating: float, file_id: str, part: int):
+        self.id = id
+        self.code = code
+        self.name = name
+        self.quality = quality
+        self.year = year
+        self.language = language
+        self.rating = rating
+        self.file_id = file_id
+        self.part = part
+
+    @classmethod
+    def from_row(cls, row) -> "MovieRecord":
+        return cls(row["id"], row["code"], row["name"], row["quality"], row["year"], row["language"], row["rating"], row["file_id"], row["part"])
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+# Kino katalogi: code -> qismlar (part bo'yicha tartiblangan), id -> yozuv
+class Catalog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_code: Dict[str, List[MovieRecord]] = {}
+        self._by_id: Dict[int, MovieRecord] = {}
+        self._votes: Dict[str, int] = {}
+        self.loaded = False
+
+    def load(self, rows, votes: Optional[Dict[str, int]] = None):
+        by_code, by_id = {}, {}
+        for row in rows:
+            rec = MovieRecord.from_row(row)
+            by_id[rec.id] = rec
+            by_code.setdefault(rec.code, []).append(rec)
+        for parts in by_code.values():
+            parts.sort(key=lambda r: (r.part, r.id))
+        with self._lock:
+            self._by_code, self._by_id = by_code, by_id
+            self._votes = votes or {}
+            self.loaded = True
+
+    def clear(self):
+        with self._lock:
+            self._by_code, self._by_id, self._votes = {}, {}, {}
+            self.loaded = False
+
+    def add(self, rec: MovieRecord):
+        with self._lock:
+            old = self._by_id.get(rec.id)
+            if old is not None:
+                self._by_code[old.code] = [r for r in self._by_code.get(old.code, []) if r.id != rec.id]
+            self._by_id[rec.id] = rec
+            parts = [r for r in self._by_code.get(rec.code, []) if r.id != rec.id]
+            parts.append(rec)
+            parts.sort(key=lambda r: (r.part, r.id))
+            self._by_code[rec.code] = parts
+
+    def remove_code(self, code: str):
+        with self._lock:
+            for rec in self._by_code.pop(code, []):
+                self._by_id.pop(rec.id, None)
+
+    def set_rating(self, code: str, rating: float, votes: Optional[int] = None):
+        with self._lock:
+            for rec in self._by_code.get(code, []):
+                rec.rating = rating
+            if votes is not None:
+                self._votes[code] = votes
+
+    def votes(self, code: str) -> int:
+        return self._votes.get(code, 0)
+
+    def get_by_code(self, code: str) -> List[MovieRecord]:
+        return list(self._by_code.get(code, ()))
+
+    def get_by_id(self, movie_id: int) -> Optional[MovieRecord]:
+        return self._by_id.get(movie_id)
+
+    def __len__(self):
+        return len(self._by_id)
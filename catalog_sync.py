@@ -0,0 +1,187 @@
+import os
+import html
+import asyncio
+import logging
+from typing import Dict, List, Any
+
+from telegram.error import RetryAfter, TelegramError
+
+import db
+from ratelimit import AdaptiveTokenBucket
+
+SYNC_RATE = float(os.getenv("SYNC_RATE", "20"))
+SYNC_CHUNK = int(os.getenv("SYNC_CHUNK", "200"))
+CHECKPOINT_EVERY = 20
+MAX_RETRIES = 5
+INGEST_DELAY = float(os.getenv("SYNC_INGEST_DELAY", "2"))
+INGEST_MAX = int(os.getenv("SYNC_INGEST_MAX", "200"))
+
+logger = logging.getLogger(__name__)
+
+_exports: Dict[int, asyncio.Task] = {}
+_ingest_buffers: Dict[int, List[Dict[str, Any]]] = {}
+_ingest_timers: Dict[int, asyncio.Task] = {}
+
+def sync_caption(m) -> str:
+    return f"#KINO_SYNC\nCode: {m['code']}\nName: {m['name']}\nYear: {m['year']}\nQuality: {m['quality']}\nLang: {m['language']}\nRating: {m['rating']}\nPart: {m['part']}"
+
+def parse_sync_caption(cap: str, file_id: str) -> Dict[str, Any]:
+    data = {k.strip(): v.strip() for k, v in (line.split(":", 1) for line in cap.split("\n") if ":" in line)}
+    return {
+        "code": data.get("Code", ""),
+        "name": data.get("Name", ""),
+        "quality": data.get("Quality", ""),
+        "year": data.get("Year", ""),
+        "language": data.get("Lang", ""),
+        "rating": float(data.get("Rating") or 5.0),
+        "file_id": file_id,
+        "part": int(data.get("Part") or 1),
+    }
+
+async def _notify(bot, chat_id: int, text: str, **kwargs):
+    # Xabar yuborilmasa faqat logga yoziladi: natija (saqlangan/saqlanmagan) o'zgarmaydi
+    try:
+        await bot.send_message(chat_id, text, **kwargs)
+    except Exception as e:
+        logger.warning(f"Sync xabari {chat_id} ga yuborilmadi: {e}")
+
+# #KINO_SYNC qabul qilish: videolar buferda yig'iladi va bitta tranzaksiyada yoziladi
+async def _flush_ingest(bot, chat_id: int):
+    movies = _ingest_buffers.pop(chat_id, [])
+    _ingest_timers.pop(chat_id, None)
+    if not movies:
+        return
+    try:
+        inserted, updated = await db.aupsert_movies(movies)
+        text = f"✅ Sync qabul qilindi: {len(movies)} ta qism (yangi: {inserted}, yangilandi: {updated})"
+    except Exception as e:
+        logger.error(f"Sync ingest xatosi: {e}")
+        text = f"❌ Sync saqlanmadi ({len(movies)} ta qism): {e}"
+    await _notify(bot, chat_id, text)
+
+async def _delayed_flush(bot, chat_id: int):
+    await asyncio.sleep(INGEST_DELAY)
+    await _flush_ingest(bot, chat_id)
+
+async def ingest(bot, chat_id: int, movie: Dict[str, Any]):
+    buf = _ingest_buffers.setdefault(chat_id, [])
+    buf.append(movie)
+    timer = _ingest_timers.pop(chat_id, None)
+    if timer is not None:
+        timer.cancel()
+    if len(buf) >= INGEST_MAX:
+        await _flush_ingest(bot, chat_id)
+    else:
+        _ingest_timers[chat_id] = asyncio.create_task(_delayed_flush(bot, chat_id))
+
+async def _produce(after_id: int, chunks: asyncio.Queue):
+    # Keyingi bo'lak DB dan o'qilayotganda oldingisi yuborilmoqda; xato navbat orqali eksportga uzatiladi
+    try:
+        while True:
+            rows = await db.aget_movies_after(after_id, SYNC_CHUNK)
+            await chunks.put(rows)
+            if len(rows) < SYNC_CHUNK:
+                await chunks.put(None)
+                return
+            after_id = rows[-1]["id"]
+    except Exception as e:
+        await chunks.put(e)
+
+async def _send_movie(bot, limiter: AdaptiveTokenBucket, chat_id: int, m):
+    retries = 0
+    while True:
+        await limiter.acquire()
+        try:
+            await bot.send_video(chat_id, video=m["file_id"], caption=sync_caption(m))
+            limiter.on_success()
+            return retries, None
+        except RetryAfter as e:
+            retries += 1
+            limiter.on_retry_after(e.retry_after)
+            if retries >= MAX_RETRIES:
+                return retries, f"RetryAfter x{retries}"
+        except TelegramError as e:
+            logger.warning(f"Sync: kino {m['id']} yuborilmadi: {e}")
+            return retries, str(e)
+
+async def _export(bot, chat_id: int, state):
+    limiter = AdaptiveTokenBucket(SYNC_RATE)
+    chunks = asyncio.Queue(maxsize=2)
+    producer = asyncio.create_task(_produce(state["last_movie_id"], chunks))
+    last_id, sent, retried, failures = state["last_movie_id"], 0, 0, []
+    error = None
+    try:
+        while True:
+            rows = await chunks.get()
+            if rows is None:
+                break
+            if isinstance(rows, Exception):
+                raise rows
+            for m in rows:
+                r, err = await _send_movie(bot, limiter, chat_id, m)
+                retried += r
+                if err:
+                    failures.append((m["id"], m["code"], m["part"], err))
+                else:
+                    sent += 1
+                last_id = m["id"]
+                if (sent + len(failures)) % CHECKPOINT_EVERY == 0:
+                    await db.asave_sync_export(chat_id, last_id, sent, retried, failures)
+                    sent, retried, failures = 0, 0, []
+        await db.asave_sync_export(chat_id, last_id, sent, retried, failures, status="done")
+    except asyncio.CancelledError:
+        await db.asave_sync_export(chat_id, last_id, sent, retried, failures)
+        raise
+    except Exception as e:
+        # Kutilmagan xato: checkpoint saqlanadi, admin qisman natija va xatoni oladi (/sync_send davom ettiradi)
+        logger.exception(f"Sync eksport {chat_id} to'xtadi")
+        error = e
+        try:
+            await db.asave_sync_export(chat_id, last_id, sent, retried, failures)
+        except Exception as save_error:
+            logger.error(f"Sync checkpoint saqlanmadi: {save_error}")
+    finally:
+        producer.cancel()
+        _exports.pop(chat_id, None)
+    try:
+        text = await export_summary(chat_id)
+    except Exception as e:
+        logger.error(f"Sync natijasi o'qilmadi: {e}")
+        text = f"🔄 <b>Sync natijasi:</b> oxirgi kino id {last_id}"
+    if error is not None:
+        text = f"⚠️ <b>Sync to'xtadi:</b> {html.escape(str(error) or type(error).__name__)}\n/sync_send bilan davom ettiring.\n\n" + text
+    await _notify(bot, chat_id, text, parse_mode="HTML")
+
+async def export_summary(chat_id: int) -> str:
+    state, failures = await db.aget_sync_export(chat_id)
+    text = (
+        f"🔄 <b>Sync natijasi:</b>\n\n"
+        f"🎬 Jami: {state['total']}\n"
+        f"✅ Yuborildi: {state['sent']}\n"
+        f"❌ Xato: {state['failed']}\n"
+        f"🔁 Qayta urinishlar: {state['retried']}"
+    )
+    if failures:
+        text += "\n\n<b>Yuborilmaganlar:</b>\n" + "\n".join(f"Kod {html.escape(str(f['code']))} (qism {f['part']}): {html.escape(f['error'])}" for f in failures[:20])
+        if len(failures) > 20:
+            text += f"\n... va yana {len(failures) - 20} ta"
+    return text
+
+async def start_export(bot, chat_id: int, restart: bool = False) -> str:
+    if chat_id in _exports:
+        return "🔄 Sync allaqachon ketmoqda."
+    state = await db.astart_sync_export(chat_id, restart)
+    if state["last_movie_id"]:
+        msg = f"🔄 Sync davom ettirilmoqda: {state['sent'] + state['failed']}/{state['total']} (kino id > {state['last_movie_id']})"
+    else:
+        msg = f"🔄 {state['total']} ta kino uzatilmoqda..."
+    _exports[chat_id] = asyncio.create_task(_export(bot, chat_id, state))
+    return msg
+
+async def stop_all(bot):
+    tasks = list(_exports.values()) + list(_ingest_timers.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for chat_id in list(_ingest_buffers):
+        await _flush_ingest(bot, chat_id)
@@ -0,0 +1,71 @@
+import os
+import logging
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+
+logger = logging.getLogger(__name__)
+
+def update_key(update: object) -> Optional[int]:
+    # Tartib kaliti: foydalanuvchi (user_data, ConversationHandler holati), bo'lmasa chat (kanal postlari)
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+# Turli foydalanuvchilar parallel (max_concurrent_updates gacha), bitta foydalanuvchi update lari kelish tartibida.
+# Band kalitga kelgan update navbatga qo'yiladi va slotni darhol bo'shatadi: navbatni o'sha kalitning
+# ishlayotgan update i bo'shatadi, shuning uchun bitta foydalanuvchi boshqalarning slotlarini egallamaydi
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    __slots__ = ("_queues",)
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._queues: Dict[int, Deque[Tuple[object, Awaitable[Any]]]] = {}
+
+    @property
+    def active(self) -> int:
+        return len(self._queues)
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    async def _run(self, update: object, coroutine: Awaitable[Any]):
+        try:
+            await coroutine
+        except Exception:
+            logger.exception(f"Update {getattr(update, 'update_id', None)} qayta ishlanmadi")
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = update_key(update)
+        if key is None:
+            await self._run(update, coroutine)
+            return
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append((update, coroutine))
+            return
+        queue = self._queues[key] = deque()
+        try:
+            await self._run(update, coroutine)
+            while queue:
+                await self._run(*queue.popleft())
+        finally:
+            del self._queues[key]
+            # To'xtatilganda navbatda qolganlar yopiladi ("never awaited" ogohlantirishisiz)
+            for _, pending in queue:
+                pending.close()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -1,17 +1,373 @@
+import os
+import re
+import json
+import collections
+import asyncio
+import logging
 import sqlite3
-import datetime
-from typing import Optional, List, Dict, Any
+import time
+import functools
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Tuple
+
+import search
+import catalog
+import metrics
+import tracing
+import timeutil
 
 DB_PATH = "database.db"
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+POOL_TIMEOUT = 30
+BUSY_TIMEOUT = 5
+WRITE_BEHIND_INTERVAL = int(os.getenv("WRITE_BEHIND_MS", "500")) / 1000
+WRITE_BEHIND_MAX_EVENTS = int(os.getenv("WRITE_BEHIND_MAX_EVENTS", "500"))
+GATE_CACHE_TTL = int(os.getenv("GATE_CACHE_TTL", "300"))
+GATE_CACHE_SIZE = int(os.getenv("GATE_CACHE_SIZE", "50000"))
 
-def get_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+logger = logging.getLogger(__name__)
 
-def init_db():
-    conn = get_connection()
-    cursor = conn.cursor()
+# Ulanishlar puli: har so'rov uchun yangi ulanish ochmaslik uchun
+class _Waiter:
+    __slots__ = ("event", "item")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.item: Optional[Tuple[sqlite3.Connection, int]] = None
+
+class ConnectionPool:
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: List[Tuple[sqlite3.Connection, int]] = []
+        self._waiters: "collections.deque[_Waiter]" = collections.deque()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._generation = 0
+        self._paused = False
+        self._drained = threading.Condition(self._lock)
+        self._open_gate = threading.Event()
+        self._open_gate.set()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT, check_same_thread=False, factory=tracing.connection_factory())
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def acquire(self) -> Tuple[sqlite3.Connection, int]:
+        # Navbat adolatli: bo'shagan ulanish eng uzoq kutayotganga to'g'ridan-to'g'ri beriladi
+        deadline = time.monotonic() + POOL_TIMEOUT
+        woken = False
+        while True:
+            if not self._open_gate.wait(max(0.0, deadline - time.monotonic())):
+                raise sqlite3.OperationalError("DB ulanishlar puli to'xtatilgan (timeout)")
+            waiter = None
+            with self._lock:
+                if self._paused:
+                    continue
+                first = woken or not self._waiters
+                if self._idle and first:
+                    return self._idle.pop()
+                can_create = first and self._created < self.size
+                if can_create:
+                    self._created += 1
+                    generation = self._generation
+                else:
+                    waiter = _Waiter()
+                    self._waiters.append(waiter)
+            if can_create:
+                try:
+                    return self._open(), generation
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    self._wake_one()
+                    raise
+            if not waiter.event.wait(max(0.0, deadline - time.monotonic())):
+                with self._lock:
+                    if waiter.item is None:
+                        if waiter in self._waiters:
+                            self._waiters.remove(waiter)
+                        raise sqlite3.OperationalError("DB ulanishlar puli band (timeout)")
+            if waiter.item is not None:
+                return waiter.item
+            # item yo'q: pul qayta ochildi yoki joy bo'shadi, navbatsiz qayta urinadi
+            woken = True
+
+    def _wake_one(self):
+        with self._lock:
+            waiter = self._waiters.popleft() if self._waiters and not self._paused else None
+        if waiter is not None:
+            waiter.event.set()
+
+    def release(self, conn: sqlite3.Connection, generation: int):
+        if conn.in_transaction:
+            conn.rollback()
+        waiter = None
+        with self._lock:
+            stale = generation != self._generation
+            if not stale:
+                if self._waiters:
+                    waiter = self._waiters.popleft()
+                    waiter.item = (conn, generation)
+                else:
+                    self._idle.append((conn, generation))
+        if waiter is not None:
+            waiter.event.set()
+        elif stale:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+                self._drained.notify_all()
+            self._wake_one()
+
+    def close(self):
+        # Bo'sh ulanishlar yopiladi, band ulanishlar qaytarilganda yopiladi
+        with self._lock:
+            self._generation += 1
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for conn, _ in idle:
+            conn.close()
+
+    def pause(self, timeout: float) -> bool:
+        # Yangi so'rovlar kutadi, band ulanishlar qaytarilgach yopiladi: fayl almashtirish uchun
+        with self._lock:
+            self._paused = True
+        self._open_gate.clear()
+        self.close()
+        with self._lock:
+            return self._drained.wait_for(lambda: self._created == 0, timeout)
+
+    def resume(self):
+        with self._lock:
+            self._paused = False
+            waiters, self._waiters = list(self._waiters), collections.deque()
+        self._open_gate.set()
+        for waiter in waiters:
+            waiter.event.set()
+
+class PooledConnection:
+    __slots__ = ("_conn", "_generation", "_released")
+
+    def __init__(self, conn: sqlite3.Connection, generation: int):
+        self._conn = conn
+        self._generation = generation
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            _pool.release(self._conn, self._generation)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        finally:
+            self.close()
+
+_pool = ConnectionPool(POOL_SIZE)
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def get_connection() -> PooledConnection:
+    start = time.perf_counter()
+    conn, generation = _pool.acquire()
+    metrics.db_pool_wait_seconds.observe(time.perf_counter() - start)
+    return PooledConnection(conn, generation)
+
+def close_pool():
+    _pool.close()
+
+@contextlib.contextmanager
+def paused_pool(timeout: float = POOL_TIMEOUT):
+    if not _pool.pause(timeout):
+        _pool.resume()
+        raise sqlite3.OperationalError("DB ulanishlari bo'shatilmadi (timeout)")
+    try:
+        yield
+    finally:
+        _pool.resume()
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="db")
+        return _executor
+
+def _timed_call(func, submitted: float, *args, **kwargs):
+    start = time.perf_counter()
+    metrics.db_wait_seconds.observe(start - submitted)
+    name = func.__name__
+    metrics.db_calls.inc(name)
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        metrics.db_errors.inc(name)
+        raise
+    finally:
+        metrics.db_seconds.observe(time.perf_counter() - start, name)
+
+async def run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    submitted = time.perf_counter()
+    span = tracing.current_span()
+    try:
+        return await loop.run_in_executor(_get_executor(), functools.partial(_timed_call, func, submitted, *args, **kwargs))
+    finally:
+        # Span DB vaqti: executor navbati bilan birga, handler kutgan vaqt
+        if span is not None:
+            span.db += time.perf_counter() - submitted
+            span.db_calls += 1
+
+# Write-behind bufer: request_count va ko'rish tarixi bitta tranzaksiyada yoziladi
+class WriteBehindBuffer:
+    def __init__(self, interval: float, max_events: int):
+        self.interval = interval
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._requests: Dict[str, int] = {}
+        self._history: List[Tuple[int, str, str]] = []
+        self._inflight_requests: Dict[str, int] = {}
+        self._inflight_history: List[Tuple[int, str, str]] = []
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._loop, name="db-write-behind", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush xatosi: {e}")
+
+    def _added(self):
+        if len(self._requests) + len(self._history) >= self.max_events:
+            self._wake.set()
+
+    def add_request(self, code: str):
+        with self._lock:
+            self._ensure_started()
+            self._requests[code] = self._requests.get(code, 0) + 1
+            self._added()
+
+    def add_watch(self, user_id: int, movie_code: str, watched_at: int):
+        with self._lock:
+            self._ensure_started()
+            self._history.append((user_id, movie_code, watched_at))
+            self._added()
+
+    def pending_requests(self) -> Dict[str, int]:
+        with self._lock:
+            pending = dict(self._inflight_requests)
+            for code, n in self._requests.items():
+                pending[code] = pending.get(code, 0) + n
+        return pending
+
+    def pending_watch_count(self, user_id: int) -> int:
+        with self._lock:
+            return sum(1 for h in self._history if h[0] == user_id) + sum(1 for h in self._inflight_history if h[0] == user_id)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                requests, self._requests = self._requests, {}
+                history, self._history = self._history, []
+                self._inflight_requests, self._inflight_history = requests, history
+            if not requests and not history:
+                return
+            try:
+                with get_connection() as conn:
+                    c = conn.cursor()
+                    c.executemany("UPDATE movies SET request_count = request_count + ? WHERE code = ?",
+                                  [(n, code) for code, n in requests.items()])
+                    c.executemany("INSERT INTO user_watch_history (user_id, movie_code, watched_at) VALUES (?, ?, ?)", history)
+                    if history:
+                        _record_deliveries(c, history)
+            except Exception:
+                # Yozilmagan hodisalar keyingi flush uchun buferga qaytariladi
+                with self._lock:
+                    for code, n in requests.items():
+                        self._requests[code] = self._requests.get(code, 0) + n
+                    self._history[:0] = history
+                raise
+            finally:
+                with self._lock:
+                    self._inflight_requests, self._inflight_history = {}, []
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+_write_behind = WriteBehindBuffer(WRITE_BEHIND_INTERVAL, WRITE_BEHIND_MAX_EVENTS)
+
+# Statistika: lifetime hisoblagichlar (stats_counters) va kunlik qiymatlar (stats_daily)
+STATS_LIFETIME = ("users", "deliveries", "payments", "revenue")
+STATS_METRICS = ("new_users", "deliveries", "viewers", "payments", "revenue")
+
+def _bump_stats(c: sqlite3.Cursor, metrics: Dict[str, int], day: Optional[str] = None):
+    day = day or timeutil.local_day()
+    c.executemany(
+        "INSERT INTO stats_daily (day, metric, value) VALUES (?, ?, ?) ON CONFLICT(day, metric) DO UPDATE SET value = value + excluded.value",
+        [(day, k, v) for k, v in metrics.items() if v]
+    )
+    lifetime = {"users" if k == "new_users" else k: v for k, v in metrics.items()}
+    c.executemany(
+        "INSERT INTO stats_counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+        [(k, v) for k, v in lifetime.items() if v and k in STATS_LIFETIME]
+    )
+
+def _record_deliveries(c: sqlite3.Cursor, history: List[Tuple[int, str, int]]):
+    # Har hodisa o'z watched_at kuniga yoziladi: yarim tun oldidan buferlangani keyingi kunga o'tmaydi
+    by_day: Dict[str, List[int]] = {}
+    for user_id, _, watched_at in history:
+        by_day.setdefault(timeutil.local_day(watched_at), []).append(user_id)
+    for day, user_ids in by_day.items():
+        c.executemany("INSERT OR IGNORE INTO stats_daily_viewers (day, user_id) VALUES (?, ?)", [(day, uid) for uid in set(user_ids)])
+        _bump_stats(c, {"deliveries": len(user_ids), "viewers": max(c.rowcount, 0)}, day)
+    # Kechagi to'plam ham saqlanadi (rebuild_stats bilan bir xil oyna)
+    c.execute("DELETE FROM stats_daily_viewers WHERE day < ?", (timeutil.local_day(offset_days=-1),))
+
+def flush_writes():
+    _write_behind.flush()
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+    _write_behind.stop()
+    close_pool()
+
+# Migratsiyalar: har biri bir marta, tartib bilan, bitta tranzaksiyada
+def _migrate_base_schema(cursor: sqlite3.Cursor):
 
     # 1. users
     cursor.execute("""
@@ -244,160 +600,1060 @@ def init_db():
     cursor.execute("INSERT OR IGNORE INTO bot_version (id, version, changelog, updated_at) VALUES (1, 'v2.0', 'Kino Bot v2.0 toliq ishga tushdi', datetime('now'))")
     cursor.execute("INSERT OR IGNORE INTO movie_code_counter (id, last_code) VALUES (1, 100)")
 
-    conn.commit()
-    conn.close()
+def _migrate_lookup_indexes(cursor: sqlite3.Cursor):
+    # favorites(user_id) va referrals(referred_id) UNIQUE avto-indekslari bilan qoplangan
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movies_code_part ON movies (code, part)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movies_request_count ON movies (request_count)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_user_status_end ON subscriptions (user_id, status, end_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_watch_history_user ON user_watch_history (user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movie_ratings_code ON movie_ratings (movie_code, rating)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pending_payments_status ON pending_payments (status)")
+
+def _add_column(cursor: sqlite3.Cursor, table: str, column: str, decl: str):
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row["name"] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _migrate_broadcasts(cursor: sqlite3.Cursor):
+    # bot_blocked: foydalanuvchi botni bloklagan (admin bloki is_blocked dan farqli)
+    _add_column(cursor, "users", "bot_blocked", "INTEGER DEFAULT 0")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        admin_id INTEGER,
+        from_chat_id INTEGER,
+        message_id INTEGER,
+        status TEXT DEFAULT 'running',
+        last_user_id INTEGER DEFAULT 0,
+        total INTEGER DEFAULT 0,
+        sent INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        blocked INTEGER DEFAULT 0,
+        progress_message_id INTEGER,
+        created_at TEXT,
+        finished_at TEXT
+    )
+    """)
+
+def _migrate_sync_exports(cursor: sqlite3.Cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sync_exports (
+        chat_id INTEGER PRIMARY KEY,
+        last_movie_id INTEGER DEFAULT 0,
+        total INTEGER DEFAULT 0,
+        sent INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        retried INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'running',
+        updated_at TEXT
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sync_export_failures (
+        chat_id INTEGER,
+        movie_id INTEGER,
+        code TEXT,
+        part INTEGER,
+        error TEXT,
+        PRIMARY KEY (chat_id, movie_id)
+    )
+    """)
+
+def _migrate_unique_movie_parts(cursor: sqlite3.Cursor):
+    # Takroriy (code, part) yozuvlar birlashtiriladi: eng oxirgisi qoladi, request_count qo'shiladi
+    cursor.execute("""
+    UPDATE movies SET request_count = (
+        SELECT SUM(m2.request_count) FROM movies m2 WHERE m2.code = movies.code AND m2.part = movies.part
+    )
+    WHERE id IN (SELECT MAX(id) FROM movies GROUP BY code, part HAVING COUNT(*) > 1)
+    """)
+    cursor.execute("DELETE FROM movies WHERE id NOT IN (SELECT MAX(id) FROM movies GROUP BY code, part)")
+    cursor.execute("DROP INDEX IF EXISTS idx_movies_code_part")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_movies_code_part ON movies (code, part)")
+
+def _migrate_change_journal(cursor: sqlite3.Cursor):
+    # Inkremental backup uchun: holat, jadval belgilari va o'zgarishlar jurnali
+    cursor.execute("CREATE TABLE IF NOT EXISTS backup_state (key TEXT PRIMARY KEY, value TEXT)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS backup_marks (tbl TEXT PRIMARY KEY, last_rowid INTEGER)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT,
+        row_id INTEGER
+    )
+    """)
+
+def _migrate_stats(cursor: sqlite3.Cursor):
+    # Hodisa bo'yicha yangilanadigan hisoblagichlar va kunlik yig'indilar
+    cursor.execute("CREATE TABLE IF NOT EXISTS stats_counters (name TEXT PRIMARY KEY, value INTEGER DEFAULT 0)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        day TEXT,
+        metric TEXT,
+        value INTEGER DEFAULT 0,
+        PRIMARY KEY (day, metric)
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stats_daily_viewers (
+        day TEXT,
+        user_id INTEGER,
+        PRIMARY KEY (day, user_id)
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_active_end ON subscriptions (end_date, user_id) WHERE status = 'active'")
+    # Mavjud ma'lumotlardan boshlang'ich qiymatlar
+    cursor.execute("""
+    INSERT OR REPLACE INTO stats_counters (name, value)
+    SELECT 'users', COUNT(*) FROM users
+    UNION ALL SELECT 'deliveries', COUNT(*) FROM user_watch_history
+    UNION ALL SELECT 'payments', COUNT(*) FROM pending_payments WHERE status = 'approved'
+    UNION ALL SELECT 'revenue', COALESCE(SUM(amount), 0) FROM pending_payments WHERE status = 'approved'
+    """)
+    cursor.execute("""
+    INSERT OR REPLACE INTO stats_daily (day, metric, value)
+    SELECT substr(join_date, 1, 10), 'new_users', COUNT(*) FROM users WHERE join_date IS NOT NULL GROUP BY 1
+    UNION ALL SELECT date(watched_at, 'localtime'), 'deliveries', COUNT(*) FROM user_watch_history GROUP BY 1
+    UNION ALL SELECT date(watched_at, 'localtime'), 'viewers', COUNT(DISTINCT user_id) FROM user_watch_history GROUP BY 1
+    UNION ALL SELECT substr(created_at, 1, 10), 'payments', COUNT(*) FROM pending_payments WHERE status = 'approved' GROUP BY 1
+    UNION ALL SELECT substr(created_at, 1, 10), 'revenue', COALESCE(SUM(amount), 0) FROM pending_payments WHERE status = 'approved' GROUP BY 1
+    """)
+    cursor.execute("""
+    INSERT OR IGNORE INTO stats_daily_viewers (day, user_id)
+    SELECT DISTINCT date(watched_at, 'localtime'), user_id FROM user_watch_history WHERE date(watched_at, 'localtime') >= date('now', 'localtime', '-1 day')
+    """)
+
+def _migrate_rating_aggregates(cursor: sqlite3.Cursor):
+    # Har bir kod uchun ovozlar yig'indisi va soni: o'rtacha reyting O(1) da yangilanadi
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS movie_rating_agg (
+        movie_code TEXT PRIMARY KEY,
+        rating_sum INTEGER DEFAULT 0,
+        rating_count INTEGER DEFAULT 0
+    )
+    """)
+    cursor.execute("INSERT OR REPLACE INTO movie_rating_agg SELECT movie_code, SUM(rating), COUNT(*) FROM movie_ratings GROUP BY movie_code")
+
+def _migrate_subscription_reminders(cursor: sqlite3.Cursor):
+    # Eslatma yuborilgan chegara (kun): qayta yubormaslik uchun, muddat uzaytirilganda tozalanadi
+    _add_column(cursor, "subscriptions", "reminded_days", "INTEGER")
+
+# Sana ustunlari: jadval -> (mahalliy vaqtda yozilganlar, UTC da yozilganlar)
+EPOCH_COLUMNS = {
+    "users": (("join_date",), ()),
+    "subscriptions": (("start_date", "end_date"), ()),
+    "promo_codes": (("start_date", "end_date"), ()),
+    "movie_ratings": ((), ("rated_at",)),
+    "favorites": ((), ("added_at",)),
+    "user_watch_history": ((), ("watched_at",)),
+    "promo_uses": ((), ("used_at",)),
+    "pending_payments": ((), ("created_at",)),
+    "offers": ((), ("created_at",)),
+    "admin_requests": ((), ("created_at",)),
+    "bot_version": ((), ("updated_at",)),
+    "admins": ((), ("added_date",)),
+    "trial_subscriptions": ((), ("start_date", "end_date")),
+    "referrals": ((), ("created_date",)),
+    "broadcasts": ((), ("created_at", "finished_at")),
+    "sync_exports": ((), ("updated_at",)),
+}
+
+def _rebuild_epoch_table(cursor: sqlite3.Cursor, table: str, local_cols: Tuple[str, ...], utc_cols: Tuple[str, ...]):
+    # SQLite ustun turini o'zgartira olmaydi: jadval INTEGER ustunlar bilan qayta quriladi,
+    # indekslar va AUTOINCREMENT hisoblagichi saqlanadi (jurnal triggerlari init_db da qayta yaratiladi)
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    row = cursor.fetchone()
+    if row is None:
+        return
+    sql = row["sql"]
+    for col in local_cols + utc_cols:
+        sql = re.sub(rf"\b{col}\s+TEXT\b", f"{col} INTEGER", sql)
+    tmp = f"{table}__epoch"
+    sql = re.sub(r"^CREATE TABLE\s+\S+", f"CREATE TABLE {tmp}", sql)
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,))
+    indexes = [r["sql"] for r in cursor.fetchall()]
+    cursor.execute(f"PRAGMA table_info({table})")
+    cols = [r["name"] for r in cursor.fetchall()]
+    exprs = [timeutil.sql_from_local(c) if c in local_cols else timeutil.sql_from_utc(c) if c in utc_cols else c for c in cols]
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+    seq = cursor.fetchone()
+    cursor.execute(sql)
+    cursor.execute(f"INSERT INTO {tmp} ({', '.join(cols)}) SELECT {', '.join(exprs)} FROM {table}")
+    cursor.execute(f"DROP TABLE {table}")
+    cursor.execute(f"ALTER TABLE {tmp} RENAME TO {table}")
+    for index_sql in indexes:
+        cursor.execute(index_sql)
+    if seq is not None:
+        cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (seq["seq"], table))
+
+def _migrate_epoch_timestamps(cursor: sqlite3.Cursor):
+    # TEXT sanalar ("%Y-%m-%d %H:%M:%S", mahalliy yoki UTC) -> epoch soniya (INTEGER)
+    for table, (local_cols, utc_cols) in EPOCH_COLUMNS.items():
+        _rebuild_epoch_table(cursor, table, local_cols, utc_cols)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_join_date ON users (join_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_watch_history_watched_at ON user_watch_history (watched_at)")
+
+MIGRATIONS = [
+    (1, "base schema", _migrate_base_schema),
+    (2, "lookup indexes", _migrate_lookup_indexes),
+    (3, "broadcasts", _migrate_broadcasts),
+    (4, "sync exports", _migrate_sync_exports),
+    (5, "unique movie parts", _migrate_unique_movie_parts),
+    (6, "change journal", _migrate_change_journal),
+    (7, "stats", _migrate_stats),
+    (8, "rating aggregates", _migrate_rating_aggregates),
+    (9, "subscription reminders", _migrate_subscription_reminders),
+    (10, "epoch timestamps", _migrate_epoch_timestamps),
+]
+
+JOURNAL_EXCLUDE = {"schema_version", "backup_state", "backup_marks", "change_log"}
+
+def journal_tables(c: sqlite3.Cursor) -> List[Tuple[str, bool]]:
+    # (jadval, monoton) - AUTOINCREMENT jadvallarda yangi qatorlar rowid belgisi orqali topiladi
+    c.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")
+    return [(r["name"], "AUTOINCREMENT" in r["sql"].upper()) for r in c.fetchall() if r["name"] not in JOURNAL_EXCLUDE]
+
+def _ensure_change_journal(c: sqlite3.Cursor):
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'change_log'")
+    if c.fetchone() is None:
+        return
+    for table, monotonic in journal_tables(c):
+        ops = ["UPDATE", "DELETE"] if monotonic else ["INSERT", "UPDATE", "DELETE"]
+        for op in ops:
+            ref = "NEW" if op == "INSERT" else "OLD"
+            c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_journal_{table}_{op.lower()} AFTER {op} ON {table}
+            BEGIN INSERT INTO change_log (tbl, row_id) VALUES ('{table}', {ref}.rowid); END
+            """)
+
+def get_schema_version(conn) -> int:
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+def init_db():
+    with get_connection() as conn:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TEXT
+        )
+        """)
+        conn.commit()
+        current = get_schema_version(conn)
+        for version, name, step in MIGRATIONS:
+            if version <= current:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                step(conn.cursor())
+                conn.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, datetime('now'))", (version, name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        _ensure_change_journal(conn.cursor())
+
+# Sozlamalar keshi: settings jadvali bir marta o'qiladi, set_setting orqali yangilanadi
+_settings: Optional[Dict[str, str]] = None
+_settings_lock = threading.Lock()
+
+def reload_settings() -> Dict[str, str]:
+    global _settings
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT key, value FROM settings")
+        fresh = {row["key"]: row["value"] for row in c.fetchall()}
+    with _settings_lock:
+        _settings = fresh
+    return fresh
+
+# Kirish keshi: admin, blok va obuna tugash vaqti har foydalanuvchi uchun
+class UserGate:
+    __slots__ = ("is_admin", "is_blocked", "sub_end", "expires")
+
+    def __init__(self, is_admin: bool, is_blocked: bool, sub_end: Optional[int], expires: float):
+        self.is_admin = is_admin
+        self.is_blocked = is_blocked
+        self.sub_end = sub_end
+        self.expires = expires
+
+    def has_subscription(self) -> bool:
+        return self.sub_end is not None and self.sub_end > timeutil.now()
+
+_gates: Dict[int, UserGate] = {}
+_gates_lock = threading.Lock()
+# Invalidatsiya hisoblagichi: o'qish paytida invalidate bo'lgan gate keshga qaytarilmaydi
+_gates_generation = 0
+
+def _cached_gate(user_id: int) -> Optional[UserGate]:
+    gate = _gates.get(user_id)
+    if gate is not None and gate.expires > time.monotonic():
+        return gate
+    return None
+
+def _get_gate(user_id: int) -> UserGate:
+    gate = _cached_gate(user_id)
+    if gate is not None:
+        return gate
+    generation = _gates_generation
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+        SELECT
+            EXISTS(SELECT 1 FROM admins WHERE user_id = ?) AS is_admin,
+            COALESCE((SELECT is_blocked FROM users WHERE id = ?), 0) AS is_blocked,
+            (SELECT MAX(end_date) FROM subscriptions WHERE user_id = ? AND status = 'active') AS sub_end
+        """, (user_id, user_id, user_id))
+        row = c.fetchone()
+    now = time.monotonic()
+    gate = UserGate(bool(row["is_admin"]), bool(row["is_blocked"]), row["sub_end"], now + GATE_CACHE_TTL)
+    with _gates_lock:
+        if generation != _gates_generation:
+            return gate
+        if len(_gates) >= GATE_CACHE_SIZE:
+            for uid in [uid for uid, g in _gates.items() if g.expires <= now]:
+                del _gates[uid]
+            while len(_gates) >= GATE_CACHE_SIZE:
+                del _gates[next(iter(_gates))]
+        _gates[user_id] = gate
+    return gate
+
+def invalidate_gate(user_id: Optional[int] = None):
+    global _gates_generation
+    with _gates_lock:
+        _gates_generation += 1
+        if user_id is None:
+            _gates.clear()
+        else:
+            _gates.pop(user_id, None)
+
+def reset_caches():
+    invalidate_gate()
+    invalidate_channels()
+    with _movies_lock:
+        _catalog.clear()
+        _search_index.clear()
+    reload_settings()
 
 # Helper DB Funksiyalar
 def get_setting(key: str, default: str = "") -> str:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT value FROM settings WHERE key = ?", (key,))
-    row = c.fetchone()
-    conn.close()
-    return row["value"] if row else default
+    settings = _settings
+    if settings is None:
+        settings = reload_settings()
+    return settings.get(key, default)
 
 def set_setting(key: str, value: str):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
-    conn.commit()
-    conn.close()
+    global _settings
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
+    with _settings_lock:
+        if _settings is not None:
+            _settings = {**_settings, key: str(value)}
 
 def is_admin(user_id: int, main_admin_id: int) -> bool:
     if user_id == main_admin_id:
         return True
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT user_id FROM admins WHERE user_id = ?", (user_id,))
-    row = c.fetchone()
-    conn.close()
-    return row is not None
+    return _get_gate(user_id).is_admin
+
+def add_admin(user_id: int):
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("INSERT OR IGNORE INTO admins (user_id, added_date) VALUES (?, ?)", (user_id, timeutil.now()))
+    invalidate_gate(user_id)
+
+def remove_admin(user_id: int) -> bool:
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM admins WHERE user_id = ?", (user_id,))
+        removed = c.rowcount > 0
+    invalidate_gate(user_id)
+    return removed
 
 def add_user(user_id: int, username: str, full_name: str):
-    conn = get_connection()
-    c = conn.cursor()
-    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    c.execute("INSERT OR REPLACE INTO users (id, username, full_name, join_date) VALUES (?, ?, ?, COALESCE((SELECT join_date FROM users WHERE id = ?), ?))",
-              (user_id, username, full_name, user_id, now))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("INSERT OR IGNORE INTO users (id, username, full_name, join_date) VALUES (?, ?, ?, ?)", (user_id, username, full_name, timeutil.now()))
+        if c.rowcount == 1:
+            _bump_stats(c, {"new_users": 1})
+        else:
+            c.execute("UPDATE users SET username = ?, full_name = ?, bot_blocked = 0 WHERE id = ?", (username, full_name, user_id))
 
 def is_user_blocked(user_id: int) -> bool:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT is_blocked FROM users WHERE id = ?", (user_id,))
-    row = c.fetchone()
-    conn.close()
-    return bool(row["is_blocked"]) if row else False
+    return _get_gate(user_id).is_blocked
+
+def set_user_blocked(user_id: int, blocked: bool):
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("UPDATE users SET is_blocked = ? WHERE id = ?", (1 if blocked else 0, user_id))
+    invalidate_gate(user_id)
+
+def _get_user_subscription(c: sqlite3.Cursor, user_id: int) -> Optional[sqlite3.Row]:
+    c.execute("SELECT * FROM subscriptions WHERE user_id = ? AND status = 'active' AND end_date > ? ORDER BY id DESC LIMIT 1", (user_id, timeutil.now()))
+    return c.fetchone()
 
 def get_user_subscription(user_id: int) -> Optional[sqlite3.Row]:
-    conn = get_connection()
-    c = conn.cursor()
-    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    c.execute("SELECT * FROM subscriptions WHERE user_id = ? AND status = 'active' AND end_date > ? ORDER BY id DESC LIMIT 1", (user_id, now))
-    sub = c.fetchone()
-    conn.close()
-    return sub
+    with get_connection() as conn:
+        return _get_user_subscription(conn.cursor(), user_id)
 
 def has_active_subscription(user_id: int, main_admin_id: int) -> bool:
-    if is_admin(user_id, main_admin_id):
+    if user_id == main_admin_id:
         return True
-    return get_user_subscription(user_id) is not None
+    gate = _get_gate(user_id)
+    return gate.is_admin or gate.has_subscription()
 
 def get_next_movie_code() -> str:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT last_code FROM movie_code_counter WHERE id = 1")
-    last_code = c.fetchone()["last_code"]
-    next_code = last_code + 1
-    c.execute("UPDATE movie_code_counter SET last_code = ? WHERE id = 1", (next_code,))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("SELECT last_code FROM movie_code_counter WHERE id = 1")
+        last_code = c.fetchone()["last_code"]
+        next_code = last_code + 1
+        c.execute("UPDATE movie_code_counter SET last_code = ? WHERE id = 1", (next_code,))
     return str(next_code)
 
-def add_movie(code: str, name: str, quality: str, year: str, language: str, rating: float, file_id: str, part: int = 1):
-    conn = get_connection()
-    c = conn.cursor()
+# Kino katalogi va qidiruv indeksi xotirada; movies yozuvlari _movies_lock ostida yangilanadi
+_catalog = catalog.Catalog()
+_search_index = search.SearchIndex()
+_movies_lock = threading.Lock()
+
+def load_catalog():
+    with _movies_lock:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT id, code, name, quality, year, language, rating, file_id, part FROM movies")
+            rows = c.fetchall()
+            c.execute("SELECT movie_code, rating_count FROM movie_rating_agg")
+            _catalog.load(rows, {r[0]: r[1] for r in c.fetchall()})
+
+def _ensure_catalog():
+    if not _catalog.loaded:
+        load_catalog()
+
+def _ensure_search_index():
+    with _movies_lock:
+        if _search_index.loaded:
+            return
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT code, name, year, quality, language, rating, SUM(request_count) AS popularity FROM movies GROUP BY code")
+            rows = c.fetchall()
+        _search_index.clear()
+        for r in rows:
+            _search_index.add(r["code"], r["name"], r["year"], r["quality"], r["language"], r["rating"], r["popularity"] or 0)
+        _search_index.loaded = True
+
+MANIFEST_FIELDS = ("code", "part", "name", "year", "quality", "language", "rating", "file_id")
+
+def _upsert_movie(c: sqlite3.Cursor, code: str, name: str, quality: str, year: str, language: str, rating: float, file_id: str, part: int) -> Tuple[int, bool]:
+    # (code, part) bo'yicha idempotent: mavjud qism yangilanadi, request_count saqlanadi
+    c.execute("SELECT id FROM movies WHERE code = ? AND part = ?", (code, part))
+    row = c.fetchone()
+    if row:
+        c.execute("UPDATE movies SET name = ?, quality = ?, year = ?, language = ?, rating = ?, file_id = ? WHERE id = ?",
+                  (name, quality, year, language, rating, file_id, row["id"]))
+        return row["id"], False
     c.execute("""
     INSERT INTO movies (code, name, quality, year, language, rating, file_id, part)
     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
     """, (code, name, quality, year, language, rating, file_id, part))
-    conn.commit()
-    conn.close()
+    return c.lastrowid, True
 
-def get_movie_by_id(movie_id: int) -> Optional[sqlite3.Row]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM movies WHERE id = ?", (movie_id,))
-    row = c.fetchone()
-    conn.close()
-    return row
-
-def get_movies_by_code(code: str) -> List[sqlite3.Row]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM movies WHERE code = ? ORDER BY part ASC", (code,))
-    rows = c.fetchall()
+def _apply_movies_to_memory(records: List[catalog.MovieRecord]):
+    for rec in records:
+        if _catalog.loaded:
+            _catalog.add(rec)
+        if _search_index.loaded:
+            _search_index.add(rec.code, rec.name, rec.year, rec.quality, rec.language, rec.rating)
+
+def add_movie(code: str, name: str, quality: str, year: str, language: str, rating: float, file_id: str, part: int = 1):
+    with _movies_lock:
+        with get_connection() as conn:
+            movie_id, _ = _upsert_movie(conn.cursor(), code, name, quality, year, language, rating, file_id, part)
+        _apply_movies_to_memory([catalog.MovieRecord(movie_id, code, name, quality, year, language, rating, file_id, part)])
+
+def upsert_movies(movies: List[Dict[str, Any]]) -> Tuple[int, int]:
+    # Ko'p qismni bitta tranzaksiyada yozish (sync va manifest importi uchun)
+    inserted = updated = 0
+    records = []
+    with _movies_lock:
+        with get_connection() as conn:
+            c = conn.cursor()
+            for m in movies:
+                args = (str(m["code"]), m.get("name") or "", m.get("quality") or "", str(m.get("year") or ""), m.get("language") or "",
+                        float(m.get("rating") or 5.0), m["file_id"], int(m.get("part") or 1))
+                movie_id, is_new = _upsert_movie(c, *args)
+                records.append(catalog.MovieRecord(movie_id, *args))
+                if is_new:
+                    inserted += 1
+                else:
+                    updated += 1
+        _apply_movies_to_memory(records)
+    return inserted, updated
+
+def export_manifest(path: str, chunk: int = 1000) -> int:
+    # JSON Lines: har qatorda bitta qism metama'lumoti
+    count, after_id = 0, 0
+    with open(path, "w", encoding="utf-8") as f:
+        while True:
+            rows = get_movies_after(after_id, chunk)
+            for r in rows:
+                f.write(json.dumps({k: r[k] for k in MANIFEST_FIELDS}, ensure_ascii=False) + "\n")
+            count += len(rows)
+            if len(rows) < chunk:
+                return count
+            after_id = rows[-1]["id"]
+
+def import_manifest(path: str) -> Tuple[int, int]:
+    with open(path, encoding="utf-8") as f:
+        movies = [json.loads(line) for line in f if line.strip()]
+    for i, m in enumerate(movies, 1):
+        if not m.get("code") or not m.get("file_id"):
+            raise ValueError(f"Manifest {i}-qator: code va file_id majburiy")
+    return upsert_movies(movies)
+
+def delete_movies_by_code(code: str) -> int:
+    with _movies_lock:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("DELETE FROM movies WHERE code = ?", (code,))
+            deleted = c.rowcount
+        _catalog.remove_code(code)
+        _search_index.remove(code)
+    return deleted
+
+def get_movie_by_id(movie_id: int) -> Optional[catalog.MovieRecord]:
+    _ensure_catalog()
+    return _catalog.get_by_id(movie_id)
+
+def _record_request(code: str):
+    _write_behind.add_request(code)
+    _search_index.bump(code)
+
+def get_movies_by_code(code: str) -> List[catalog.MovieRecord]:
+    _ensure_catalog()
+    rows = _catalog.get_by_code(code)
     if rows:
-        c.execute("UPDATE movies SET request_count = request_count + 1 WHERE code = ?", (code,))
-        conn.commit()
-    conn.close()
+        _record_request(code)
     return rows
 
-def search_movies_by_name(query: str) -> List[sqlite3.Row]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT code, name, year, quality, language, rating FROM movies WHERE name LIKE ? ORDER BY id DESC LIMIT 15", (f"%{query}%",))
-    rows = c.fetchall()
-    conn.close()
-    return rows
+def get_movies_after(after_id: int, limit: int) -> List[sqlite3.Row]:
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM movies WHERE id > ? ORDER BY id ASC LIMIT ?", (after_id, limit))
+        return c.fetchall()
+
+def search_movies_by_name(query: str, limit: int = 15) -> List[search.MovieEntry]:
+    _ensure_search_index()
+    return _search_index.search(query, limit)
 
 def add_rating(user_id: int, movie_code: str, rating: int):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO movie_ratings (user_id, movie_code, rating, rated_at) VALUES (?, ?, ?, datetime('now'))",
-              (user_id, movie_code, rating))
-    # Yangi o'rtacha reytingni hisoblab movies jadvaliga yozish
-    c.execute("SELECT AVG(rating) as avg_rating FROM movie_ratings WHERE movie_code = ?", (movie_code,))
-    avg_r = c.fetchone()["avg_rating"]
-    if avg_r:
-        c.execute("UPDATE movies SET rating = ROUND(?, 1) WHERE code = ?", (avg_r, movie_code))
-    conn.commit()
-    conn.close()
+    # Eski ovoz ayirilib yangisi qo'shiladi: movie_ratings qayta o'qilmaydi
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("SELECT rating FROM movie_ratings WHERE user_id = ? AND movie_code = ?", (user_id, movie_code))
+        old = c.fetchone()
+        c.execute("INSERT OR REPLACE INTO movie_ratings (user_id, movie_code, rating, rated_at) VALUES (?, ?, ?, ?)",
+                  (user_id, movie_code, rating, timeutil.now()))
+        if old is not None and old["rating"] == rating:
+            return
+        c.execute("""
+        INSERT INTO movie_rating_agg (movie_code, rating_sum, rating_count) VALUES (?, ?, ?)
+        ON CONFLICT(movie_code) DO UPDATE SET rating_sum = rating_sum + excluded.rating_sum, rating_count = rating_count + excluded.rating_count
+        RETURNING ROUND(1.0 * rating_sum / rating_count, 1), rating_count
+        """, (movie_code, rating - (old["rating"] if old else 0), 0 if old else 1))
+        avg_r, votes = c.fetchone()
+        c.execute("UPDATE movies SET rating = ? WHERE code = ? AND rating IS NOT ?", (avg_r, movie_code, avg_r))
+    _catalog.set_rating(movie_code, avg_r, votes)
+    _search_index.set_rating(movie_code, avg_r)
 
-def add_subscription(user_id: int, plan_months: int):
-    conn = get_connection()
-    c = conn.cursor()
-    now = datetime.datetime.now()
-    end_date = now + datetime.timedelta(days=plan_months * 30)
+def rebuild_rating_aggregates() -> int:
+    # Agregatlar movie_ratings dan bitta o'tishda qayta quriladi
+    with _movies_lock:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            c.execute("DELETE FROM movie_rating_agg")
+            c.execute("INSERT INTO movie_rating_agg SELECT movie_code, SUM(rating), COUNT(*) FROM movie_ratings GROUP BY movie_code")
+            codes = c.rowcount
+            c.execute("""
+            UPDATE movies SET rating = agg.avg_r
+            FROM (SELECT movie_code, ROUND(1.0 * rating_sum / rating_count, 1) AS avg_r FROM movie_rating_agg) AS agg
+            WHERE movies.code = agg.movie_code AND movies.rating IS NOT agg.avg_r
+            """)
+    _catalog.clear()
+    _search_index.clear()
+    load_catalog()
+    return codes
+
+def get_rating(movie_code: str) -> Tuple[Optional[float], int]:
+    _ensure_catalog()
+    parts = _catalog.get_by_code(movie_code)
+    return (parts[0].rating if parts else None), _catalog.votes(movie_code)
+
+def add_watch_history(user_id: int, movie_code: str):
+    _write_behind.add_watch(user_id, movie_code, timeutil.now())
+
+def get_user_stats(user_id: int) -> Tuple[int, int]:
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT COUNT(*) as cnt FROM user_watch_history WHERE user_id = ?", (user_id,))
+        watched = c.fetchone()["cnt"] + _write_behind.pending_watch_count(user_id)
+        c.execute("SELECT COUNT(*) as cnt FROM favorites WHERE user_id = ?", (user_id,))
+        favs = c.fetchone()["cnt"]
+    return watched, favs
+
+def add_favorite(user_id: int, movie_code: str) -> bool:
+    try:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("INSERT INTO favorites (user_id, movie_code, added_at) VALUES (?, ?, ?)", (user_id, movie_code, timeutil.now()))
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+def get_favorites(user_id: int) -> List[sqlite3.Row]:
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT DISTINCT m.code, m.name, m.year FROM favorites f JOIN movies m ON f.movie_code = m.code WHERE f.user_id = ?", (user_id,))
+        return c.fetchall()
+
+def _add_subscription(c: sqlite3.Cursor, user_id: int, plan_months: int):
+    now = timeutil.now()
     c.execute("""
     INSERT INTO subscriptions (user_id, plan_type, start_date, end_date, status)
     VALUES (?, ?, ?, ?, 'active')
-    """, (user_id, plan_months, now.strftime("%Y-%m-%d %H:%M:%S"), end_date.strftime("%Y-%m-%d %H:%M:%S")))
-    conn.commit()
-    conn.close()
+    """, (user_id, plan_months, now, now + timeutil.days(plan_months * 30)))
 
-def add_days_subscription(user_id: int, days: int):
-    conn = get_connection()
-    c = conn.cursor()
-    now = datetime.datetime.now()
-    sub = get_user_subscription(user_id)
+def add_subscription(user_id: int, plan_months: int):
+    with get_connection() as conn:
+        _add_subscription(conn.cursor(), user_id, plan_months)
+    invalidate_gate(user_id)
+
+def _add_days_subscription(c: sqlite3.Cursor, user_id: int, days: int):
+    now = timeutil.now()
+    sub = _get_user_subscription(c, user_id)
     if sub:
-        cur_end = datetime.datetime.strptime(sub["end_date"], "%Y-%m-%d %H:%M:%S")
-        new_end = max(now, cur_end) + datetime.timedelta(days=days)
-        c.execute("UPDATE subscriptions SET end_date = ? WHERE id = ?", (new_end.strftime("%Y-%m-%d %H:%M:%S"), sub["id"]))
+        new_end = max(now, sub["end_date"]) + timeutil.days(days)
+        c.execute("UPDATE subscriptions SET end_date = ?, reminded_days = NULL WHERE id = ?", (new_end, sub["id"]))
     else:
-        new_end = now + datetime.timedelta(days=days)
         c.execute("INSERT INTO subscriptions (user_id, plan_type, start_date, end_date, status) VALUES (?, 0, ?, ?, 'active')",
-                  (user_id, now.strftime("%Y-%m-%d %H:%M:%S"), new_end.strftime("%Y-%m-%d %H:%M:%S")))
-    conn.commit()
-    conn.close()
+                  (user_id, now, now + timeutil.days(days)))
+
+def add_days_subscription(user_id: int, days: int):
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        _add_days_subscription(c, user_id, days)
+    invalidate_gate(user_id)
+
+# Muddati o'tgan obunalar partiyalab 'expired' qilinadi: faol to'plam kichik qoladi
+def expire_subscriptions(limit: int) -> Tuple[int, List[int]]:
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("SELECT id, user_id FROM subscriptions WHERE status = 'active' AND end_date <= ? LIMIT ?", (timeutil.now(), limit))
+        rows = c.fetchall()
+        if rows:
+            c.executemany("UPDATE subscriptions SET status = 'expired' WHERE id = ?", [(r["id"],) for r in rows])
+    user_ids = sorted({r["user_id"] for r in rows})
+    for user_id in user_ids:
+        invalidate_gate(user_id)
+    return len(rows), user_ids
+
+def get_expiring_subscriptions(days: int, limit: int) -> List[sqlite3.Row]:
+    # Foydalanuvchining eng so'nggi faol obunasi `days` kun ichida tugasa va bu chegara uchun eslatilmagan bo'lsa
+    now = timeutil.now()
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+        SELECT s.id, s.user_id, s.end_date FROM subscriptions s
+        JOIN users u ON u.id = s.user_id AND u.is_blocked = 0 AND u.bot_blocked = 0
+        WHERE s.status = 'active' AND s.end_date > ? AND s.end_date <= ?
+          AND (s.reminded_days IS NULL OR s.reminded_days > ?)
+          AND NOT EXISTS (SELECT 1 FROM subscriptions s2 WHERE s2.user_id = s.user_id AND s2.status = 'active' AND s2.end_date > s.end_date)
+        ORDER BY s.end_date LIMIT ?
+        """, (now, now + timeutil.days(days), days, limit))
+        return c.fetchall()
+
+def mark_subscriptions_reminded(sub_ids: List[int], days: int):
+    with get_connection() as conn:
+        conn.executemany("UPDATE subscriptions SET reminded_days = ? WHERE id = ?", [(days, i) for i in sub_ids])
+
+def add_referral(referrer_id: int, referred_id: int) -> Optional[Tuple[str, float]]:
+    rew_type = get_setting("referral_reward_type", "free_days")
+    rew_val = float(get_setting("referral_reward_value", "3"))
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id FROM referrals WHERE referred_id = ?", (referred_id,))
+        if c.fetchone():
+            return None
+        c.execute("INSERT INTO referrals (referrer_id, referred_id, reward_type, reward_value, status, created_date) VALUES (?, ?, ?, ?, 'completed', ?)",
+                  (referrer_id, referred_id, rew_type, rew_val, timeutil.now()))
+        if rew_type == "free_days":
+            _add_days_subscription(c, referrer_id, int(rew_val))
+    invalidate_gate(referrer_id)
+    return rew_type, rew_val
+
+def use_trial(user_id: int, days: int) -> bool:
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("SELECT used FROM trial_subscriptions WHERE user_id = ?", (user_id,))
+        row = c.fetchone()
+        if row and row["used"] == 1:
+            return False
+        now = timeutil.now()
+        c.execute("INSERT OR REPLACE INTO trial_subscriptions (user_id, trial_days, start_date, end_date, used) VALUES (?, ?, ?, ?, 1)",
+                  (user_id, days, now, now + timeutil.days(days)))
+        _add_days_subscription(c, user_id, days)
+    invalidate_gate(user_id)
+    return True
+
+def redeem_promo(user_id: int, code: str) -> Tuple[str, int]:
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("SELECT * FROM promo_codes WHERE code = ? AND is_active = 1", (code,))
+        p = c.fetchone()
+        if not p:
+            return "not_found", 0
+        c.execute("SELECT id FROM promo_uses WHERE promo_id = ? AND user_id = ?", (p["id"], user_id))
+        if c.fetchone():
+            return "used", 0
+        c.execute("INSERT INTO promo_uses (promo_id, user_id, used_at) VALUES (?, ?, ?)", (p["id"], user_id, timeutil.now()))
+        c.execute("UPDATE promo_codes SET used_count = used_count + 1 WHERE id = ?", (p["id"],))
+        days = int(p["duration_days"] or p["discount_value"])
+        _add_days_subscription(c, user_id, days)
+    invalidate_gate(user_id)
+    return "ok", days
+
+def add_pending_payment(user_id: int, username: str, full_name: str, months: int, amount: str, check_file_id: str, check_type: str) -> int:
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("INSERT INTO pending_payments (user_id, username, full_name, months, amount, check_file_id, check_type, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, 'pending', ?)",
+                  (user_id, username, full_name, months, amount, check_file_id, check_type, timeutil.now()))
+        return c.lastrowid
+
+def approve_payment(pay_id: int) -> Optional[sqlite3.Row]:
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        # Update lar parallel ishlanadi: tekshirish va yozish bitta yozish tranzaksiyasida (ikki marta tasdiqlanmaydi)
+        c.execute("SELECT * FROM pending_payments WHERE id = ?", (pay_id,))
+        p = c.fetchone()
+        if not p or p["status"] != "pending":
+            return None
+        c.execute("UPDATE pending_payments SET status = 'approved' WHERE id = ?", (pay_id,))
+        _add_subscription(c, p["user_id"], p["months"])
+        _bump_stats(c, {"payments": 1, "revenue": p["amount"] or 0})
+    invalidate_gate(p["user_id"])
+    return p
+
+def reject_payment(pay_id: int):
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("UPDATE pending_payments SET status = 'rejected' WHERE id = ?", (pay_id,))
+
+def add_offer(user_id: int, username: str, full_name: str, message: str):
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("INSERT INTO offers (user_id, username, full_name, message, created_at) VALUES (?, ?, ?, ?, ?)", (user_id, username, full_name, message, timeutil.now()))
+
+def add_admin_request(user_id: int, username: str, full_name: str, message: str):
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("INSERT INTO admin_requests (user_id, username, full_name, message, status, created_at) VALUES (?, ?, ?, ?, 'pending', ?)", (user_id, username, full_name, message, timeutil.now()))
+
+def get_bot_stats(days: int = 30) -> Dict[str, Any]:
+    # Jadval hajmiga bog'liq emas: hisoblagichlar, oxirgi kunlar qatorlari va indeksli top-5
+    _ensure_catalog()
+    since = timeutil.local_day(offset_days=-(days - 1))
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT name, value FROM stats_counters")
+        totals = {k: 0 for k in STATS_LIFETIME}
+        totals.update({r["name"]: r["value"] for r in c.fetchall()})
+        c.execute("SELECT day, metric, value FROM stats_daily WHERE day >= ? ORDER BY day DESC", (since,))
+        daily: Dict[str, Dict[str, int]] = {}
+        for r in c.fetchall():
+            daily.setdefault(r["day"], dict.fromkeys(STATS_METRICS, 0))[r["metric"]] = r["value"]
+        c.execute("SELECT COUNT(DISTINCT user_id) AS cnt FROM subscriptions WHERE status = 'active' AND end_date > ?", (timeutil.now(),))
+        s_cnt = c.fetchone()["cnt"]
+        c.execute("SELECT id, code, name, request_count FROM movies ORDER BY request_count DESC LIMIT 5")
+        candidates = {r["id"]: dict(r) for r in c.fetchall()}
+        # Hali yozilmagan so'rovlar ham hisobga olinadi
+        pending = _write_behind.pending_requests()
+        if pending:
+            marks = ",".join("?" * len(pending))
+            c.execute(f"SELECT id, code, name, request_count FROM movies WHERE code IN ({marks})", list(pending))
+            candidates.update({r["id"]: dict(r) for r in c.fetchall()})
+    for m in candidates.values():
+        m["request_count"] += pending.get(m["code"], 0)
+    top_movies = sorted(candidates.values(), key=lambda m: m["request_count"], reverse=True)[:5]
+    return {
+        "users": totals["users"],
+        "subscriptions": s_cnt,
+        "movies": len(_catalog),
+        "deliveries": totals["deliveries"],
+        "payments": totals["payments"],
+        "revenue": totals["revenue"],
+        "daily": daily,
+        "top_movies": top_movies,
+    }
+
+def rebuild_stats() -> int:
+    # Hisoblagichlar va kunlik qiymatlar jadvallardan qayta hisoblanadi (epoch ustunlar, mahalliy kun)
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("DELETE FROM stats_counters")
+        c.execute("DELETE FROM stats_daily")
+        c.execute("DELETE FROM stats_daily_viewers")
+        c.execute("""
+        INSERT INTO stats_counters (name, value)
+        SELECT 'users', COUNT(*) FROM users
+        UNION ALL SELECT 'deliveries', COUNT(*) FROM user_watch_history
+        UNION ALL SELECT 'payments', COUNT(*) FROM pending_payments WHERE status = 'approved'
+        UNION ALL SELECT 'revenue', COALESCE(SUM(amount), 0) FROM pending_payments WHERE status = 'approved'
+        """)
+        c.execute("""
+        INSERT INTO stats_daily (day, metric, value)
+        SELECT date(join_date, 'unixepoch', 'localtime'), 'new_users', COUNT(*) FROM users WHERE join_date IS NOT NULL GROUP BY 1
+        UNION ALL SELECT date(watched_at, 'unixepoch', 'localtime'), 'deliveries', COUNT(*) FROM user_watch_history GROUP BY 1
+        UNION ALL SELECT date(watched_at, 'unixepoch', 'localtime'), 'viewers', COUNT(DISTINCT user_id) FROM user_watch_history GROUP BY 1
+        UNION ALL SELECT date(created_at, 'unixepoch', 'localtime'), 'payments', COUNT(*) FROM pending_payments WHERE status = 'approved' GROUP BY 1
+        UNION ALL SELECT date(created_at, 'unixepoch', 'localtime'), 'revenue', COALESCE(SUM(amount), 0) FROM pending_payments WHERE status = 'approved' GROUP BY 1
+        """)
+        rows = c.rowcount
+        c.execute("""
+        INSERT OR IGNORE INTO stats_daily_viewers (day, user_id)
+        SELECT DISTINCT date(watched_at, 'unixepoch', 'localtime'), user_id FROM user_watch_history
+        WHERE watched_at >= CAST(strftime('%s', date('now', 'localtime', '-1 day'), 'utc') AS INTEGER)
+        """)
+    return rows
+
+# Majburiy kanallar ro'yxati keshda, mandatory_subscriptions o'zgarganda tozalanadi
+_channels: Optional[List[sqlite3.Row]] = None
+
+def invalidate_channels():
+    global _channels
+    _channels = None
 
 def get_mandatory_channels() -> List[sqlite3.Row]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM mandatory_subscriptions WHERE status = 'active'")
-    rows = c.fetchall()
-    conn.close()
+    global _channels
+    channels = _channels
+    if channels is None:
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT * FROM mandatory_subscriptions WHERE status = 'active'")
+            channels = _channels = c.fetchall()
+    return channels
+
+def add_mandatory_channel(channel_id: str, channel_url: str, channel_name: str):
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+        INSERT INTO mandatory_subscriptions (channel_id, channel_url, channel_name, status) VALUES (?, ?, ?, 'active')
+        ON CONFLICT(channel_id) DO UPDATE SET channel_url = excluded.channel_url, channel_name = excluded.channel_name, status = 'active'
+        """, (channel_id, channel_url, channel_name))
+    invalidate_channels()
+
+def remove_mandatory_channel(channel_id: str) -> bool:
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM mandatory_subscriptions WHERE channel_id = ?", (channel_id,))
+        removed = c.rowcount > 0
+    invalidate_channels()
+    return removed
+
+# Broadcast (ommaviy xabar) holati
+def create_broadcast(admin_id: int, from_chat_id: int, message_id: int, progress_message_id: int) -> int:
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT COUNT(*) AS cnt FROM users WHERE is_blocked = 0 AND bot_blocked = 0")
+        total = c.fetchone()["cnt"]
+        c.execute("""
+        INSERT INTO broadcasts (admin_id, from_chat_id, message_id, status, total, progress_message_id, created_at)
+        VALUES (?, ?, ?, 'running', ?, ?, ?)
+        """, (admin_id, from_chat_id, message_id, total, progress_message_id, timeutil.now()))
+        return c.lastrowid
+
+def get_broadcast(broadcast_id: int) -> Optional[sqlite3.Row]:
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+        return c.fetchone()
+
+def get_running_broadcasts() -> List[sqlite3.Row]:
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id")
+        return c.fetchall()
+
+def get_broadcast_targets(after_user_id: int, limit: int) -> List[int]:
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id FROM users WHERE id > ? AND is_blocked = 0 AND bot_blocked = 0 ORDER BY id LIMIT ?", (after_user_id, limit))
+        return [row["id"] for row in c.fetchall()]
+
+def save_broadcast_progress(broadcast_id: int, last_user_id: int, sent: int, failed_ids: List[int], blocked_ids: List[int]):
+    # Progress va muvaffaqiyatsiz yuborishlar bitta tranzaksiyada saqlanadi
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+        UPDATE broadcasts SET last_user_id = ?, sent = sent + ?, failed = failed + ?, blocked = blocked + ? WHERE id = ?
+        """, (last_user_id, sent, len(failed_ids), len(blocked_ids), broadcast_id))
+        c.executemany("UPDATE users SET failed_sends = failed_sends + 1 WHERE id = ?", [(uid,) for uid in failed_ids + blocked_ids])
+        c.executemany("UPDATE users SET bot_blocked = 1 WHERE id = ?", [(uid,) for uid in blocked_ids])
+
+def finish_broadcast(broadcast_id: int, status: str):
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ?", (status, timeutil.now(), broadcast_id))
+
+# /sync_send eksport holati (checkpoint)
+def start_sync_export(chat_id: int, restart: bool = False) -> sqlite3.Row:
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM sync_exports WHERE chat_id = ?", (chat_id,))
+        state = c.fetchone()
+        if state is None or restart or state["status"] != "running":
+            c.execute("SELECT COUNT(*) AS cnt FROM movies")
+            total = c.fetchone()["cnt"]
+            c.execute("""
+            INSERT OR REPLACE INTO sync_exports (chat_id, last_movie_id, total, sent, failed, retried, status, updated_at)
+            VALUES (?, 0, ?, 0, 0, 0, 'running', ?)
+            """, (chat_id, total, timeutil.now()))
+            c.execute("DELETE FROM sync_export_failures WHERE chat_id = ?", (chat_id,))
+            c.execute("SELECT * FROM sync_exports WHERE chat_id = ?", (chat_id,))
+            state = c.fetchone()
+        return state
+
+def save_sync_export(chat_id: int, last_movie_id: int, sent: int, retried: int, failures: List[Tuple[int, str, int, str]], status: str = "running"):
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+        UPDATE sync_exports SET last_movie_id = ?, sent = sent + ?, failed = failed + ?, retried = retried + ?, status = ?, updated_at = ?
+        WHERE chat_id = ?
+        """, (last_movie_id, sent, len(failures), retried, status, timeutil.now(), chat_id))
+        c.executemany("INSERT OR REPLACE INTO sync_export_failures (chat_id, movie_id, code, part, error) VALUES (?, ?, ?, ?, ?)",
+                      [(chat_id,) + f for f in failures])
+
+def get_sync_export(chat_id: int) -> Tuple[Optional[sqlite3.Row], List[sqlite3.Row]]:
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM sync_exports WHERE chat_id = ?", (chat_id,))
+        state = c.fetchone()
+        c.execute("SELECT * FROM sync_export_failures WHERE chat_id = ? ORDER BY movie_id", (chat_id,))
+        return state, c.fetchall()
+
+# Async API: handlerlar event loopni bloklamasligi uchun
+def _awaitable(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+    return wrapper
+
+async def aget_setting(key: str, default: str = "") -> str:
+    settings = _settings
+    if settings is not None:
+        return settings.get(key, default)
+    return await run(get_setting, key, default)
+
+async def ais_admin(user_id: int, main_admin_id: int) -> bool:
+    if user_id == main_admin_id:
+        return True
+    gate = _cached_gate(user_id)
+    if gate is not None:
+        return gate.is_admin
+    return await run(is_admin, user_id, main_admin_id)
+
+async def ais_user_blocked(user_id: int) -> bool:
+    gate = _cached_gate(user_id)
+    if gate is not None:
+        return gate.is_blocked
+    return await run(is_user_blocked, user_id)
+
+async def ahas_active_subscription(user_id: int, main_admin_id: int) -> bool:
+    if user_id == main_admin_id:
+        return True
+    gate = _cached_gate(user_id)
+    if gate is not None:
+        return gate.is_admin or gate.has_subscription()
+    return await run(has_active_subscription, user_id, main_admin_id)
+
+async def aget_movie_by_id(movie_id: int) -> Optional[catalog.MovieRecord]:
+    if _catalog.loaded:
+        return _catalog.get_by_id(movie_id)
+    return await run(get_movie_by_id, movie_id)
+
+async def aget_rating(movie_code: str) -> Tuple[Optional[float], int]:
+    if _catalog.loaded:
+        parts = _catalog.get_by_code(movie_code)
+        return (parts[0].rating if parts else None), _catalog.votes(movie_code)
+    return await run(get_rating, movie_code)
+
+async def aget_movies_by_code(code: str) -> List[catalog.MovieRecord]:
+    if not _catalog.loaded:
+        return await run(get_movies_by_code, code)
+    rows = _catalog.get_by_code(code)
+    if rows:
+        _record_request(code)
     return rows
-    
\ No newline at end of file
+
+aset_setting = _awaitable(set_setting)
+aadd_admin = _awaitable(add_admin)
+aremove_admin = _awaitable(remove_admin)
+aadd_user = _awaitable(add_user)
+aset_user_blocked = _awaitable(set_user_blocked)
+aget_user_subscription = _awaitable(get_user_subscription)
+aget_next_movie_code = _awaitable(get_next_movie_code)
+aadd_movie = _awaitable(add_movie)
+aupsert_movies = _awaitable(upsert_movies)
+aexport_manifest = _awaitable(export_manifest)
+aimport_manifest = _awaitable(import_manifest)
+adelete_movies_by_code = _awaitable(delete_movies_by_code)
+aget_movies_after = _awaitable(get_movies_after)
+asearch_movies_by_name = _awaitable(search_movies_by_name)
+aadd_rating = _awaitable(add_rating)
+arebuild_rating_aggregates = _awaitable(rebuild_rating_aggregates)
+aadd_watch_history = _awaitable(add_watch_history)
+aget_user_stats = _awaitable(get_user_stats)
+aadd_favorite = _awaitable(add_favorite)
+aget_favorites = _awaitable(get_favorites)
+aadd_subscription = _awaitable(add_subscription)
+aadd_days_subscription = _awaitable(add_days_subscription)
+aexpire_subscriptions = _awaitable(expire_subscriptions)
+aget_expiring_subscriptions = _awaitable(get_expiring_subscriptions)
+amark_subscriptions_reminded = _awaitable(mark_subscriptions_reminded)
+aadd_referral = _awaitable(add_referral)
+ause_trial = _awaitable(use_trial)
+aredeem_promo = _awaitable(redeem_promo)
+aadd_pending_payment = _awaitable(add_pending_payment)
+aapprove_payment = _awaitable(approve_payment)
+areject_payment = _awaitable(reject_payment)
+aadd_offer = _awaitable(add_offer)
+aadd_admin_request = _awaitable(add_admin_request)
+aget_bot_stats = _awaitable(get_bot_stats)
+arebuild_stats = _awaitable(rebuild_stats)
+aadd_mandatory_channel = _awaitable(add_mandatory_channel)
+aremove_mandatory_channel = _awaitable(remove_mandatory_channel)
+
+async def aget_mandatory_channels() -> List[sqlite3.Row]:
+    channels = _channels
+    if channels is not None:
+        return channels
+    return await run(get_mandatory_channels)
+
+acreate_broadcast = _awaitable(create_broadcast)
+aget_broadcast = _awaitable(get_broadcast)
+aget_running_broadcasts = _awaitable(get_running_broadcasts)
+aget_broadcast_targets = _awaitable(get_broadcast_targets)
+asave_broadcast_progress = _awaitable(save_broadcast_progress)
+afinish_broadcast = _awaitable(finish_broadcast)
+astart_sync_export = _awaitable(start_sync_export)
+asave_sync_export = _awaitable(save_sync_export)
+aget_sync_export = _awaitable(get_sync_export)
@@ -0,0 +1,371 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import collections
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import db
+import main
+import metrics
+import webserver
+
+TOKEN = "123456:LOADTEST"
+USER_BASE = 1_000_000
+NAMES = ("Avatar", "Titanik", "Qasoskorlar", "Shrek", "Matritsa", "Interstellar", "Joker", "Gladiator", "Inception", "Dune")
+REPLY_METHODS = ("sendMessage", "sendVideo", "sendPhoto", "sendDocument", "editMessageText", "editMessageCaption", "copyMessage")
+API_METHODS = REPLY_METHODS + ("getMe", "getUpdates", "deleteWebhook", "setWebhook", "getChatMember", "answerCallbackQuery", "deleteMessage", "close", "logOut")
+
+logger = logging.getLogger("loadtest")
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, round(q * (len(sorted_values) - 1)))]
+
+# Lokal Bot API: getUpdates navbati, javoblar kechikishi va RetryAfter (429) in'ektsiyasi
+class FakeBotApi:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, retry_after_rate: float = 0.0, retry_after: int = 1, member_status: str = "member"):
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.member_status = member_status
+        self.server = webserver.WebServer("127.0.0.1", 0)
+        self.calls: Dict[str, int] = collections.Counter()
+        self.injected = 0
+        self.fetched = 0
+        self._updates: Deque[Dict[str, Any]] = collections.deque()
+        self._has_updates = asyncio.Event()
+        self._waiting: Dict[int, Tuple[float, asyncio.Future]] = {}
+        self._message_id = 0
+        self._update_id = 0
+        self._rnd = random.Random(3)
+        for method in API_METHODS:
+            self.server.route("POST", f"/bot{TOKEN}/{method}", self._handle)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.port}/bot"
+
+    async def start(self):
+        await self.server.start()
+
+    async def stop(self):
+        self._has_updates.set()
+        await self.server.stop()
+
+    def push(self, update: Dict[str, Any]):
+        # update_id yuborish paytida beriladi: navbat offset bo'yicha tartibli qolishi shart
+        self._update_id += 1
+        update["update_id"] = self._update_id
+        self._updates.append(update)
+        self._has_updates.set()
+
+    def expect(self, chat_id: int) -> asyncio.Future:
+        # Foydalanuvchi chatiga kelgan birinchi javob shu futureni yopadi
+        fut = asyncio.get_running_loop().create_future()
+        self._waiting[chat_id] = (time.perf_counter(), fut)
+        return fut
+
+    def forget(self, chat_id: int):
+        self._waiting.pop(chat_id, None)
+
+    def _resolve(self, chat_id: int):
+        waiting = self._waiting.pop(chat_id, None)
+        if waiting is not None and not waiting[1].done():
+            waiting[1].set_result(time.perf_counter() - waiting[0])
+
+    def _message(self, chat_id: int, params: Dict[str, str]) -> Dict[str, Any]:
+        self._message_id += 1
+        msg = {"message_id": self._message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}}
+        if "text" in params:
+            msg["text"] = params["text"]
+        if "caption" in params:
+            msg["caption"] = params["caption"]
+        return msg
+
+    async def _get_updates(self, params: Dict[str, str]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+        if not self._updates:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        batch = list(self._updates)[:int(params.get("limit") or 100)]
+        self.fetched += len(batch)
+        return batch
+
+    async def _handle(self, request: webserver.Request) -> webserver.Response:
+        method = request.path.rsplit("/", 1)[-1]
+        self.calls[method] += 1
+        params = {k: v[0] for k, v in parse_qs(request.body.decode()).items()}
+        if method == "getUpdates":
+            return self._ok(await self._get_updates(params))
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self._rnd.random() * self.jitter)
+        if method in REPLY_METHODS or method == "answerCallbackQuery":
+            if self._rnd.random() < self.retry_after_rate:
+                self.injected += 1
+                return webserver.Response(429, json.dumps({
+                    "ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }), "application/json")
+        if method == "getMe":
+            return self._ok({"id": int(TOKEN.split(":")[0]), "is_bot": True, "first_name": "Kino", "username": "kino_load_bot"})
+        if method == "getChatMember":
+            user_id = int(params.get("user_id") or 0)
+            return self._ok({"status": self.member_status, "user": {"id": user_id, "is_bot": False, "first_name": "U"}})
+        if method == "answerCallbackQuery":
+            # Bo'sh answer() handler boshida chaqiriladi (DB ishidan oldin): vaqt o'lchanmaydi.
+            # Matnli javob (alert) esa rate kabi oqimlarning yakuniy javobi
+            if "text" in params:
+                self._resolve(int(params.get("callback_query_id", "0:").split(":")[0]))
+            return self._ok(True)
+        if method in REPLY_METHODS:
+            chat_id = int(params.get("chat_id") or 0)
+            self._resolve(chat_id)
+            if method == "copyMessage":
+                self._message_id += 1
+                return self._ok({"message_id": self._message_id})
+            return self._ok(self._message(chat_id, params))
+        return self._ok(True)
+
+    @staticmethod
+    def _ok(result) -> webserver.Response:
+        return webserver.Response(200, json.dumps({"ok": True, "result": result}), "application/json")
+
+# Trafik: har virtual foydalanuvchi ketma-ket oqimlarni bajaradi, javobni kutadi (yopiq sikl)
+class Traffic:
+    def __init__(self, api: FakeBotApi, codes: List[str], mix: Dict[str, float], timeout: float, think: float):
+        self.api = api
+        self.codes = codes
+        self.flows = list(mix)
+        self.weights = [mix[f] for f in self.flows]
+        self.timeout = timeout
+        self.think = think
+        self._message_id = 0
+        self.reset()
+
+    def reset(self):
+        self.sent = 0
+        self.replied = 0
+        self.timeouts = 0
+        self.latencies: Dict[str, List[float]] = collections.defaultdict(list)
+
+    def _next_message_id(self) -> int:
+        # Faqat message_id va callback id uchun; update_id ni FakeBotApi.push beradi
+        self._message_id += 1
+        return self._message_id
+
+    @staticmethod
+    def _user(uid: int) -> Dict[str, Any]:
+        return {"id": uid, "is_bot": False, "first_name": f"User{uid}", "username": f"u{uid}"}
+
+    def _message(self, uid: int, text: Optional[str] = None, photo: bool = False) -> Dict[str, Any]:
+        message_id = self._next_message_id()
+        msg = {"message_id": message_id, "date": int(time.time()), "chat": {"id": uid, "type": "private"}, "from": self._user(uid)}
+        if text is not None:
+            msg["text"] = text
+            if text.startswith("/"):
+                msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        if photo:
+            msg["photo"] = [{"file_id": f"check_{uid}", "file_unique_id": f"c{uid}", "width": 90, "height": 90}]
+        return {"message": msg}
+
+    def _callback(self, uid: int, data: str) -> Dict[str, Any]:
+        message_id = self._next_message_id()
+        message = {"message_id": message_id, "date": int(time.time()), "chat": {"id": uid, "type": "private"}, "text": "menu"}
+        return {"callback_query": {
+            "id": f"{uid}:{message_id}", "from": self._user(uid), "chat_instance": str(uid), "data": data, "message": message,
+        }}
+
+    def steps(self, flow: str, uid: int, rnd: random.Random) -> List[Tuple[Dict[str, Any], bool]]:
+        # (update, javob kutiladimi)
+        code = rnd.choice(self.codes) if rnd.random() > 0.05 else "999999"
+        if flow == "start":
+            return [(self._message(uid, "/start"), True)]
+        if flow == "code":
+            return [(self._message(uid, code), True)]
+        if flow == "search":
+            return [(self._message(uid, "🔍 Nom yozish"), True), (self._message(uid, rnd.choice(NAMES)[:rnd.randint(3, 6)]), True)]
+        if flow == "rate":
+            return [(self._callback(uid, f"rate_{code}_{rnd.randint(1, 5)}"), True)]
+        if flow == "favorites":
+            return [(self._message(uid, "❤️ Sevimlilar"), True)]
+        if flow == "profile":
+            return [(self._message(uid, "📈 Statistika"), True)]
+        if flow == "pay":
+            return [
+                (self._message(uid, "💰 Rejalar va narxlar"), True),
+                (self._callback(uid, f"buy_{rnd.choice((1, 3, 6, 12))}"), True),
+                (self._message(uid, photo=True), True),
+            ]
+        raise ValueError(f"Noma'lum oqim: {flow}")
+
+    async def user_loop(self, uid: int, deadline: float, rnd: random.Random):
+        while time.monotonic() < deadline:
+            flow = rnd.choices(self.flows, self.weights)[0]
+            for update, wait_reply in self.steps(flow, uid, rnd):
+                fut = self.api.expect(uid) if wait_reply else None
+                self.api.push(update)
+                self.sent += 1
+                if fut is None:
+                    continue
+                try:
+                    self.latencies[flow].append(await asyncio.wait_for(fut, self.timeout))
+                    self.replied += 1
+                except asyncio.TimeoutError:
+                    self.api.forget(uid)
+                    self.timeouts += 1
+                    break
+            if self.think:
+                await asyncio.sleep(rnd.random() * 2 * self.think)
+
+def seed(users: int, codes: int, subscribed: float, channels: int) -> List[str]:
+    rnd = random.Random(11)
+    movies, out = [], []
+    for i in range(codes):
+        code = str(1000 + i)
+        out.append(code)
+        for part in range(1, (3 if i % 10 == 0 else 1) + 1):
+            movies.append({"code": code, "part": part, "name": f"{NAMES[i % len(NAMES)]} {i}", "year": str(rnd.randint(1990, 2024)),
+                           "quality": "720p", "language": "O'zbek", "rating": 5.0, "file_id": f"video_{code}_{part}"})
+    db.upsert_movies(movies)
+    for i in range(users):
+        uid = USER_BASE + i
+        db.add_user(uid, f"u{uid}", f"User{uid}")
+        if rnd.random() < subscribed:
+            db.add_subscription(uid, 1)
+    for i in range(channels):
+        db.add_mandatory_channel(f"-100{i + 1}", f"https://t.me/kanal{i + 1}", f"Kanal {i + 1}")
+    db.flush_writes()
+    return out
+
+def _wait_totals() -> Tuple[float, float, int, float]:
+    pool_n, pool_s = metrics.db_pool_wait_seconds.totals()
+    exec_n, exec_s = metrics.db_wait_seconds.totals()
+    return pool_s, exec_s, exec_n, metrics.db_seconds.totals()[1]
+
+async def run_step(traffic: Traffic, api: FakeBotApi, users: int, duration: float) -> Dict[str, Any]:
+    traffic.reset()
+    fetched, injected = api.fetched, api.injected
+    pool_s, exec_s, exec_n, db_s = _wait_totals()
+    started = time.perf_counter()
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*(traffic.user_loop(USER_BASE + i, deadline, random.Random(i)) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    pool_s2, exec_s2, exec_n2, db_s2 = _wait_totals()
+    processed = api.fetched - fetched
+    all_lat = sorted(x for v in traffic.latencies.values() for x in v)
+    return {
+        "users": users,
+        "seconds": round(elapsed, 2),
+        "updates": processed,
+        "updates_s": processed / elapsed,
+        "replied": traffic.replied,
+        "timeouts": traffic.timeouts,
+        "retry_after_injected": api.injected - injected,
+        "p50_ms": _percentile(all_lat, 0.50) * 1000,
+        "p90_ms": _percentile(all_lat, 0.90) * 1000,
+        "p99_ms": _percentile(all_lat, 0.99) * 1000,
+        "flows": {f: {"n": len(v), "p50_ms": _percentile(sorted(v), 0.5) * 1000, "p99_ms": _percentile(sorted(v), 0.99) * 1000}
+                  for f, v in sorted(traffic.latencies.items())},
+        "db_calls": exec_n2 - exec_n,
+        "db_busy_s": db_s2 - db_s,
+        "pool_wait_s": pool_s2 - pool_s,
+        "executor_wait_s": exec_s2 - exec_s,
+        # Ulanish puli + executor navbati kutishi; SQLite busy kutishi busy_timeout ichida va bu yerga kirmaydi
+        "pool_wait_ms_per_update": ((pool_s2 - pool_s) + (exec_s2 - exec_s)) / max(processed, 1) * 1000,
+    }
+
+def _parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+async def amain(args):
+    api = FakeBotApi(args.latency / 1000, args.jitter / 1000, args.retry_after_rate, args.retry_after)
+    await api.start()
+    db.DB_PATH = args.db or os.path.join(tempfile.mkdtemp(prefix="kino_load_"), "load.db")
+    db.init_db()
+    db.load_catalog()
+    users = max(args.users)
+    print(f"DB: {db.DB_PATH} | seed: {users} foydalanuvchi, {args.codes} kod")
+    codes = seed(users, args.codes, args.subscribed, args.channels)
+
+    main.BOT_MODE = "polling"
+    app = main.build_application(TOKEN, api.base_url)
+    errors: Dict[str, int] = collections.Counter()
+
+    async def count_error(update, context):
+        errors[type(context.error).__name__] += 1
+
+    app.add_error_handler(count_error)
+    await app.initialize()
+    await main.on_startup(app)
+    mode = await main.start_updates(app)
+    await app.start()
+    traffic = Traffic(api, codes, _parse_mix(args.mix), args.timeout, args.think / 1000)
+    results = []
+    try:
+        print(f"{'users':>6} {'upd/s':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'timeout':>8} {'429':>5} {'poolwait/upd':>13}")
+        for n in args.users:
+            r = await run_step(traffic, api, n, args.duration)
+            results.append(r)
+            print(f"{n:>6} {r['updates_s']:>8.1f} {r['p50_ms']:>6.1f}ms {r['p90_ms']:>6.1f}ms {r['p99_ms']:>6.1f}ms "
+                  f"{r['timeouts']:>8} {r['retry_after_injected']:>5} {r['pool_wait_ms_per_update']:>11.2f}ms")
+            await asyncio.sleep(args.timeout)
+    finally:
+        # main.serve() bilan bir xil tartib: on_shutdown bot hali ochiqligida
+        await app.updater.stop()
+        await app.stop()
+        try:
+            await main.on_shutdown(app)
+        finally:
+            await app.shutdown()
+            await api.stop()
+    if errors:
+        print("Handler xatolari: " + ", ".join(f"{k}={v}" for k, v in errors.most_common()))
+    report = {"mode": mode, "handler_errors": dict(errors), "latency_ms": args.latency, "retry_after_rate": args.retry_after_rate, "mix": _parse_mix(args.mix),
+              "api_calls": dict(api.calls), "steps": results}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nNatijalar: {args.out}")
+    return report
+
+def cli():
+    parser = argparse.ArgumentParser(description="Kino bot uchun lokal yuklama testi (soxta Bot API bilan)")
+    parser.add_argument("--users", type=int, nargs="+", default=[10, 50, 100], help="bir vaqtdagi virtual foydalanuvchilar, bosqichma-bosqich")
+    parser.add_argument("--duration", type=float, default=20, help="har bosqich davomiyligi, soniya")
+    parser.add_argument("--mix", default="start=1,code=6,search=2,rate=2,favorites=1,profile=1,pay=0.5")
+    parser.add_argument("--latency", type=float, default=30, help="Bot API javob kechikishi, ms")
+    parser.add_argument("--jitter", type=float, default=20, help="qo'shimcha tasodifiy kechikish, ms")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="429 RetryAfter ulushi (0..1)")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--think", type=float, default=200, help="foydalanuvchi harakatlari orasidagi o'rtacha pauza, ms")
+    parser.add_argument("--timeout", type=float, default=10, help="javob kutish chegarasi, soniya")
+    parser.add_argument("--codes", type=int, default=2000)
+    parser.add_argument("--subscribed", type=float, default=0.7, help="obunasi bor foydalanuvchilar ulushi")
+    parser.add_argument("--channels", type=int, default=1, help="majburiy kanallar (getChatMember yuklamasi)")
+    parser.add_argument("--db", help="DB fayli (berilmasa vaqtinchalik)")
+    parser.add_argument("--out", default="loadtest_results.json")
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args()
+    # main import paytida INFO darajani o'rnatadi
+    logging.getLogger().setLevel(args.log_level.upper())
+    asyncio.run(amain(args))
+
+if __name__ == "__main__":
+    cli()
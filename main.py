@@ -1,11 +1,15 @@
 import os
 import re
 import html
+import json
+import signal
 import asyncio
+import secrets
+import time
 import logging
+import shutil
 import datetime
-import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from collections import OrderedDict
 from dotenv import load_dotenv
 
 from telegram import (
@@ -24,29 +28,41 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
+from telegram.error import TelegramError
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 import db
 import backup_restore
-
-# Render/Koyeb port xatosini oldini olish
-class DummyServer(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.end_headers()
-        self.wfile.write(b"Kino Bot v2.0 Live")
-
-def start_server():
-    port = int(os.environ.get("PORT", 8080))
-    server = HTTPServer(("0.0.0.0", port), DummyServer)
-    server.serve_forever()
-
-threading.Thread(target=start_server, daemon=True).start()
+import timeutil
+import broadcast
+import catalog_sync
+import concurrency
+import subscriptions
+import metrics
+import tracing
+import webserver
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 MAIN_ADMIN = int(os.getenv("MAIN_ADMIN", "6887251996"))
 db.DB_PATH = os.getenv("DB_PATH", "database.db")
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "1"))
+RESTORE_DIR = "restore_upload"
+
+# Yangilanishlarni qabul qilish: BOT_MODE=webhook (WEBHOOK_URL bilan) yoki polling
+PORT = int(os.getenv("PORT", "8080"))
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Barcha instansiyalarda bir xil bo'lishi shart (setWebhook bilan ro'yxatdan o'tadi): webhook rejimida majburiy
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+MEMBER_CACHE_TTL = int(os.getenv("MEMBER_CACHE_TTL", "600"))
+MEMBER_NEGATIVE_TTL = int(os.getenv("MEMBER_NEGATIVE_TTL", "30"))
+MEMBER_CHECK_CONCURRENCY = int(os.getenv("MEMBER_CHECK_CONCURRENCY", "5"))
+MEMBER_CACHE_SIZE = 100000
 
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
 
@@ -100,28 +116,49 @@ def get_admin_settings_inline():
         [InlineKeyboardButton("🔄 Sync Markazi", callback_data="adm_sync_hub"), InlineKeyboardButton("💾 Zaxira (Backup)", callback_data="adm_backup_hub")],
         [InlineKeyboardButton("📊 Bot Statistikasi", callback_data="adm_stats_hub")]
     ])
-    # Majburiy obunani tekshirish
-async def check_mandatory_sub(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
-    if db.is_admin(user_id, MAIN_ADMIN):
-        return True
-    channels = db.get_mandatory_channels()
-    for ch in channels:
+
+# Kanal a'zoligi keshi (LRU): (user_id, channel_id) -> (a'zomi, amal qilish muddati)
+_member_cache = OrderedDict()
+
+async def is_channel_member(user_id: int, channel_id: str, context: ContextTypes.DEFAULT_TYPE, sem: asyncio.Semaphore, recheck: bool = False) -> bool:
+    key = (user_id, channel_id)
+    cached = _member_cache.get(key)
+    now = time.monotonic()
+    if cached and cached[1] > now and (cached[0] or not recheck):
+        _member_cache.move_to_end(key)
+        return cached[0]
+    async with sem:
         try:
-            member = await context.bot.get_chat_member(chat_id=ch["channel_id"], user_id=user_id)
-            if member.status in ["left", "kicked"]:
-                return False
+            member = await context.bot.get_chat_member(chat_id=channel_id, user_id=user_id)
         except Exception:
-            continue
-    return True
+            return True
+    is_member = member.status not in ["left", "kicked"]
+    # To'lganda eng uzoq ishlatilmagan yozuvlar chiqariladi (har qo'shishda O(1), to'liq skan yo'q)
+    _member_cache.pop(key, None)
+    while len(_member_cache) >= MEMBER_CACHE_SIZE:
+        _member_cache.popitem(last=False)
+    _member_cache[key] = (is_member, now + (MEMBER_CACHE_TTL if is_member else MEMBER_NEGATIVE_TTL))
+    return is_member
+
+# Majburiy obunani tekshirish
+async def check_mandatory_sub(user_id: int, context: ContextTypes.DEFAULT_TYPE, recheck: bool = False) -> bool:
+    if await db.ais_admin(user_id, MAIN_ADMIN):
+        return True
+    channels = await db.aget_mandatory_channels()
+    if not channels:
+        return True
+    sem = asyncio.Semaphore(MEMBER_CHECK_CONCURRENCY)
+    results = await asyncio.gather(*[is_channel_member(user_id, ch["channel_id"], context, sem, recheck) for ch in channels])
+    return all(results)
 
 # /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    if db.is_user_blocked(user.id):
+    if await db.ais_user_blocked(user.id):
         await update.message.reply_text("⛔ Siz botdan bloklangansiz.")
         return
 
-    db.add_user(user.id, user.username or "", user.full_name)
+    await db.aadd_user(user.id, user.username or "", user.full_name)
 
     # Referral tekshiruvi
     if context.args and len(context.args) > 0:
@@ -130,26 +167,16 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             try:
                 ref_id = int(arg.split("_")[1])
                 if ref_id != user.id:
-                    conn = db.get_connection()
-                    c = conn.cursor()
-                    c.execute("SELECT * FROM referrals WHERE referred_id = ?", (user.id,))
-                    if not c.fetchone():
-                        rew_type = db.get_setting("referral_reward_type", "free_days")
-                        rew_val = float(db.get_setting("referral_reward_value", "3"))
-                        c.execute("INSERT INTO referrals (referrer_id, referred_id, reward_type, reward_value, status, created_date) VALUES (?, ?, ?, ?, 'completed', datetime('now'))",
-                                  (ref_id, user.id, rew_type, rew_val))
-                        conn.commit()
-                        if rew_type == "free_days":
-                            db.add_days_subscription(ref_id, int(rew_val))
-                            await context.bot.send_message(ref_id, f"🎉 <b>Do'stingiz qo'shildi!</b> Hisobingizga +{int(rew_val)} kun bepul obuna berildi!", parse_mode="HTML")
-                    conn.close()
+                    reward = await db.aadd_referral(ref_id, user.id)
+                    if reward and reward[0] == "free_days":
+                        await context.bot.send_message(ref_id, f"🎉 <b>Do'stingiz qo'shildi!</b> Hisobingizga +{int(reward[1])} kun bepul obuna berildi!", parse_mode="HTML")
             except Exception as e:
                 logging.error(f"Ref error: {e}")
 
     # Majburiy obuna tekshiruvi
     is_subbed = await check_mandatory_sub(user.id, context)
     if not is_subbed:
-        channels = db.get_mandatory_channels()
+        channels = await db.aget_mandatory_channels()
         kb_buttons = [[InlineKeyboardButton(f"📢 {ch['channel_name'] or 'Kanal'}", url=ch['channel_url'])] for ch in channels]
         kb_buttons.append([InlineKeyboardButton("✅ Obunani tekshirish", callback_data="check_mand_sub")])
         await update.message.reply_text(
@@ -168,7 +195,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Asosiy Menyu Routeri
 async def menu_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if db.is_user_blocked(user_id):
+    if await db.ais_user_blocked(user_id):
         return
 
     text = update.message.text
@@ -192,9 +219,9 @@ async def menu_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif text == "❤️ Sevimlilar":
         await show_favorites(update, context)
     elif text == "📊 Obuna holati":
-        sub = db.get_user_subscription(user_id)
-        if sub or db.is_admin(user_id, MAIN_ADMIN):
-            end_date = sub["end_date"] if sub else "Cheksiz (Admin)"
+        sub = await db.aget_user_subscription(user_id)
+        if sub or await db.ais_admin(user_id, MAIN_ADMIN):
+            end_date = timeutil.fmt(sub["end_date"]) if sub else "Cheksiz (Admin)"
             await update.message.reply_text(f"✅ <b>Obunangiz faol!</b>\nTugash sanasi: <code>{end_date}</code>", parse_mode="HTML")
         else:
             await update.message.reply_text("❌ <b>Sizda faol obuna yo'q.</b>", parse_mode="HTML")
@@ -212,17 +239,11 @@ async def menu_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode="HTML"
         )
     elif text == "📈 Statistika":
-        conn = db.get_connection()
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) as cnt FROM user_watch_history WHERE user_id = ?", (user_id,))
-        w = c.fetchone()["cnt"]
-        c.execute("SELECT COUNT(*) as cnt FROM favorites WHERE user_id = ?", (user_id,))
-        f = c.fetchone()["cnt"]
-        conn.close()
+        w, f = await db.aget_user_stats(user_id)
         await update.message.reply_text(f"📊 Ko'rilgan: {w} ta\n❤️ Sevimlilar: {f} ta", parse_mode="HTML")
     elif text == "⏰ Obuna muddati":
-        sub = db.get_user_subscription(user_id)
-        msg = f"⏰ Muddat: <code>{sub['end_date']}</code>" if sub else "Faol obuna yo'q."
+        sub = await db.aget_user_subscription(user_id)
+        msg = f"⏰ Muddat: <code>{timeutil.fmt(sub['end_date'])}</code>" if sub else "Faol obuna yo'q."
         await update.message.reply_text(msg, parse_mode="HTML")
     elif text == "💬 Taklif yuborish":
         await update.message.reply_text("Taklifingizni yozing:")
@@ -235,22 +256,19 @@ async def menu_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif text.isdigit():
         await deliver_movie_by_code(update, context, text)
         # Kino yetkazish logikasi
+@metrics.track_handler
 async def deliver_movie_by_code(update: Update, context: ContextTypes.DEFAULT_TYPE, code: str):
     user_id = update.effective_user.id
-    if not db.has_active_subscription(user_id, MAIN_ADMIN):
+    if not await db.ahas_active_subscription(user_id, MAIN_ADMIN):
         await update.message.reply_text("🔒 <b>Kino ko'rish uchun obuna kerak!</b>\n💳 OBUNA bo'limidan to'lov qiling.", parse_mode="HTML")
         return
 
-    movies = db.get_movies_by_code(code)
+    movies = await db.aget_movies_by_code(code)
     if not movies:
         await update.message.reply_text("❌ Bunday kodli kino topilmadi.")
         return
 
-    conn = db.get_connection()
-    c = conn.cursor()
-    c.execute("INSERT INTO user_watch_history (user_id, movie_code, watched_at) VALUES (?, ?, datetime('now'))", (user_id, code))
-    conn.commit()
-    conn.close()
+    await db.aadd_watch_history(user_id, code)
 
     if len(movies) == 1:
         await send_single_movie(update.message, movies[0])
@@ -263,12 +281,14 @@ async def deliver_movie_by_code(update: Update, context: ContextTypes.DEFAULT_TY
         )
 
 async def send_single_movie(target, m):
+    rating, votes = await db.aget_rating(m["code"])
+    rating_text = f"{rating}/5.0 ({votes} ovoz)" if votes else f"{m['rating']}/5.0"
     caption = (
         f"🎬 <b>{html.escape(m['name'])}</b>\n\n"
         f"📅 Yili: {m['year']}\n"
         f"💾 Sifati: {m['quality']}\n"
         f"🌐 Tili: {m['language']}\n"
-        f"⭐ Reyting: {m['rating']}/5.0\n"
+        f"⭐ Reyting: {rating_text}\n"
         f"🔑 Kodi: <code>{m['code']}</code> (Qism: {m['part']})"
     )
     kb = InlineKeyboardMarkup([
@@ -292,29 +312,24 @@ async def global_callback_router(update: Update, context: ContextTypes.DEFAULT_T
 
     if data.startswith("rate_"):
         _, code, val = data.split("_")
-        db.add_rating(user_id, code, int(val))
+        await db.aadd_rating(user_id, code, int(val))
         await query.answer(f"⭐ {val} ball qabul qilindi!", show_alert=True)
 
     elif data.startswith("fav_"):
         code = data.split("_")[1]
-        try:
-            conn = db.get_connection()
-            c = conn.cursor()
-            c.execute("INSERT INTO favorites (user_id, movie_code, added_at) VALUES (?, ?, datetime('now'))", (user_id, code))
-            conn.commit()
-            conn.close()
+        if await db.aadd_favorite(user_id, code):
             await query.answer("❤️ Sevimlilarga qo'shildi!", show_alert=True)
-        except Exception:
+        else:
             await query.answer("Allaqachon sevimlilarda bor.", show_alert=True)
 
     elif data.startswith("getpart_"):
         mid = int(data.split("_")[1])
-        m = db.get_movie_by_id(mid)
+        m = await db.aget_movie_by_id(mid)
         if m:
             await send_single_movie(query.message, m)
 
     elif data == "check_mand_sub":
-        if await check_mandatory_sub(user_id, context):
+        if await check_mandatory_sub(user_id, context, recheck=True):
             await query.message.delete()
             await context.bot.send_message(user_id, "✅ Obuna tasdiqlandi!", reply_markup=get_main_menu_keyboard())
         else:
@@ -322,50 +337,50 @@ async def global_callback_router(update: Update, context: ContextTypes.DEFAULT_T
 
     elif data.startswith("pay_app_"):
         pay_id = int(data.split("_")[2])
-        conn = db.get_connection()
-        c = conn.cursor()
-        c.execute("SELECT * FROM pending_payments WHERE id = ?", (pay_id,))
-        p = c.fetchone()
-        if p and p["status"] == "pending":
-            c.execute("UPDATE pending_payments SET status = 'approved' WHERE id = ?", (pay_id,))
-            conn.commit()
-            db.add_subscription(p["user_id"], p["months"])
+        p = await db.aapprove_payment(pay_id)
+        if p:
             await query.edit_message_caption(caption=query.message.caption + "\n\n✅ <b>TASDIQLANDI</b>", parse_mode="HTML")
             await context.bot.send_message(p["user_id"], f"🎉 <b>To'lovingiz tasdiqlandi!</b>\n{p['months']} oylik obuna faollashtirildi.", parse_mode="HTML")
-        conn.close()
 
     elif data.startswith("pay_rej_"):
         pay_id = int(data.split("_")[2])
-        conn = db.get_connection()
-        c = conn.cursor()
-        c.execute("UPDATE pending_payments SET status = 'rejected' WHERE id = ?", (pay_id,))
-        conn.commit()
-        conn.close()
+        await db.areject_payment(pay_id)
         await query.edit_message_caption(caption=query.message.caption + "\n\n❌ <b>RAD ETILDI</b>", parse_mode="HTML")
 
     elif data == "adm_stats_hub":
-        conn = db.get_connection()
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) as cnt FROM users")
-        u_cnt = c.fetchone()["cnt"]
-        c.execute("SELECT COUNT(*) as cnt FROM subscriptions WHERE status = 'active'")
-        s_cnt = c.fetchone()["cnt"]
-        c.execute("SELECT COUNT(*) as cnt FROM movies")
-        m_cnt = c.fetchone()["cnt"]
-        c.execute("SELECT name, request_count FROM movies ORDER BY request_count DESC LIMIT 5")
-        top_movies = c.fetchall()
-        conn.close()
-        text = f"📊 <b>Bot Statistikasi:</b>\n\n👥 Foydalanuvchilar: {u_cnt}\n💳 Obunachilar: {s_cnt}\n🎬 Kinolar: {m_cnt}\n\n<b>Top 5 Kino:</b>\n"
-        for i, tm in enumerate(top_movies, 1):
-            text += f"{i}. {tm['name']} — {tm['request_count']} marta\n"
-        await query.message.reply_text(text, parse_mode="HTML")
+        st = await db.aget_bot_stats()
+        await query.message.reply_text(format_bot_stats(st), parse_mode="HTML")
 
     elif data == "adm_backup_hub":
-        zf = backup_restore.create_backup_zip()
-        if zf:
-            with open(zf, "rb") as doc:
-                await context.bot.send_document(user_id, document=doc, caption="📦 <b>Baza Zaxirasi</b>", parse_mode="HTML")
-            os.remove(zf)
+        await backup_restore.send_backup(context.bot, user_id, "📦 <b>Baza Zaxirasi</b>", f"backup_{user_id}")
+
+def _period_sum(daily, days: int, metric: str) -> int:
+    since = timeutil.local_day(offset_days=-(days - 1))
+    return sum(d[metric] for day, d in daily.items() if day >= since)
+
+def format_bot_stats(st) -> str:
+    daily = st["daily"]
+    text = (
+        f"📊 <b>Bot Statistikasi:</b>\n\n"
+        f"👥 Foydalanuvchilar: {st['users']}\n"
+        f"💳 Faol obunachilar: {st['subscriptions']}\n"
+        f"🎬 Kinolar: {st['movies']}\n"
+        f"📥 Yuborilgan kinolar: {st['deliveries']}\n"
+        f"💰 To'lovlar: {st['payments']} ({st['revenue']:,} so'm)\n\n"
+        f"<b>Davr bo'yicha (bugun / 7 kun / 30 kun):</b>\n"
+    )
+    labels = [("new_users", "👤 Yangi"), ("deliveries", "📥 Yuborildi"), ("viewers", "👁 Tomoshabin (kunlik)"), ("payments", "💳 To'lov"), ("revenue", "💰 Tushum")]
+    for metric, label in labels:
+        text += f"{label}: {_period_sum(daily, 1, metric)} / {_period_sum(daily, 7, metric)} / {_period_sum(daily, 30, metric)}\n"
+    text += "\n<b>Oxirgi 7 kun:</b>\n"
+    for i in range(7):
+        day = timeutil.local_day(offset_days=-i)
+        d = daily.get(day, dict.fromkeys(db.STATS_METRICS, 0))
+        text += f"<code>{day[5:]}</code> 👤{d['new_users']} 📥{d['deliveries']} 👁{d['viewers']} 💳{d['payments']}\n"
+    text += "\n<b>Top 5 Kino:</b>\n"
+    for i, tm in enumerate(st["top_movies"], 1):
+        text += f"{i}. {tm['name']} — {tm['request_count']} marta\n"
+    return text
 
 # Qidiruv va Murojaat Handlerlari
 async def search_code_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -373,7 +388,7 @@ async def search_code_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     return ConversationHandler.END
 
 async def search_name_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    results = db.search_movies_by_name(update.message.text.strip())
+    results = await db.asearch_movies_by_name(update.message.text.strip())
     if not results:
         await update.message.reply_text("❌ Kino topilmadi.")
         return ConversationHandler.END
@@ -383,71 +398,45 @@ async def search_name_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def offer_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    conn = db.get_connection()
-    c = conn.cursor()
-    c.execute("INSERT INTO offers (user_id, username, full_name, message, created_at) VALUES (?, ?, ?, ?, datetime('now'))", (u.id, u.username, u.full_name, update.message.text))
-    conn.commit()
-    conn.close()
+    await db.aadd_offer(u.id, u.username, u.full_name, update.message.text)
     await update.message.reply_text("✅ Taklif yuborildi.")
     return ConversationHandler.END
 
 async def admin_msg_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    conn = db.get_connection()
-    c = conn.cursor()
-    c.execute("INSERT INTO admin_requests (user_id, username, full_name, message, status, created_at) VALUES (?, ?, ?, ?, 'pending', datetime('now'))", (u.id, u.username, u.full_name, update.message.text))
-    conn.commit()
-    conn.close()
+    await db.aadd_admin_request(u.id, u.username, u.full_name, update.message.text)
     await context.bot.send_message(MAIN_ADMIN, f"🆘 <b>Yangi murojaat:</b> {u.full_name} (@{u.username}):\n\n{update.message.text}", parse_mode="HTML")
     await update.message.reply_text("✅ Murojaat adminga yuborildi.")
     return ConversationHandler.END
 
 async def handle_trial(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    conn = db.get_connection()
-    c = conn.cursor()
-    c.execute("SELECT used FROM trial_subscriptions WHERE user_id = ?", (uid,))
-    row = c.fetchone()
-    if row and row["used"] == 1:
-        await update.message.reply_text("❌ Siz trial olgansiz.")
-    else:
-        days = int(db.get_setting("trial_days", "3"))
-        c.execute("INSERT OR REPLACE INTO trial_subscriptions (user_id, trial_days, start_date, end_date, used) VALUES (?, ?, datetime('now'), datetime('now', '+3 days'), 1)", (uid, days))
-        db.add_days_subscription(uid, days)
-        conn.commit()
+    days = int(await db.aget_setting("trial_days", "3"))
+    if await db.ause_trial(uid, days):
         await update.message.reply_text(f"🎉 Sizga {days} kun bepul berildi!")
-    conn.close()
+    else:
+        await update.message.reply_text("❌ Siz trial olgansiz.")
 
 async def promo_input_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
     code = update.message.text.strip().upper()
-    conn = db.get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM promo_codes WHERE code = ? AND is_active = 1", (code,))
-    p = c.fetchone()
-    if not p:
+    status, days = await db.aredeem_promo(uid, code)
+    if status == "not_found":
         await update.message.reply_text("❌ Bunday promo-kod yo'q.")
+    elif status == "used":
+        await update.message.reply_text("❌ Bu kodni ishlatgansiz.")
     else:
-        c.execute("SELECT * FROM promo_uses WHERE promo_id = ? AND user_id = ?", (p["id"], uid))
-        if c.fetchone():
-            await update.message.reply_text("❌ Bu kodni ishlatgansiz.")
-        else:
-            c.execute("INSERT INTO promo_uses (promo_id, user_id, used_at) VALUES (?, ?, datetime('now'))", (p["id"], uid))
-            c.execute("UPDATE promo_codes SET used_count = used_count + 1 WHERE id = ?", (p["id"],))
-            conn.commit()
-            days = int(p["duration_days"] or p["discount_value"])
-            db.add_days_subscription(uid, days)
-            await update.message.reply_text(f"🎉 Promo qabul qilindi: +{days} kun!")
-    conn.close()
+        await update.message.reply_text(f"🎉 Promo qabul qilindi: +{days} kun!")
     return ConversationHandler.END
 
 # To'lov Handlerlari
 async def show_plans(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    p1, p3, p6, p12 = [await db.aget_setting(f"price_{m}", d) for m, d in ((1, "5000"), (3, "15000"), (6, "30000"), (12, "60000"))]
     kb = InlineKeyboardMarkup([
-        [InlineKeyboardButton(f"1 oylik — {db.get_setting('price_1', '5000')} so'm", callback_data="buy_1"),
-         InlineKeyboardButton(f"3 oylik — {db.get_setting('price_3', '15000')} so'm", callback_data="buy_3")],
-        [InlineKeyboardButton(f"6 oylik — {db.get_setting('price_6', '30000')} so'm", callback_data="buy_6"),
-         InlineKeyboardButton(f"12 oylik — {db.get_setting('price_12', '60000')} so'm", callback_data="buy_12")]
+        [InlineKeyboardButton(f"1 oylik — {p1} so'm", callback_data="buy_1"),
+         InlineKeyboardButton(f"3 oylik — {p3} so'm", callback_data="buy_3")],
+        [InlineKeyboardButton(f"6 oylik — {p6} so'm", callback_data="buy_6"),
+         InlineKeyboardButton(f"12 oylik — {p12} so'm", callback_data="buy_12")]
     ])
     await update.message.reply_text("💰 Obuna rejasini tanlang:", reply_markup=kb)
 
@@ -456,9 +445,11 @@ async def plan_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.answer()
     m = int(q.data.split("_")[1])
     context.user_data["pay_months"] = m
-    context.user_data["pay_amount"] = db.get_setting(f"price_{m}", "5000")
+    context.user_data["pay_amount"] = await db.aget_setting(f"price_{m}", "5000")
+    card_number = await db.aget_setting("card_number")
+    card_holder = await db.aget_setting("card_holder")
     await q.edit_message_text(
-        f"💳 Karta: <code>{db.get_setting('card_number')}</code>\n👤 Egasi: {db.get_setting('card_holder')}\nSumma: {context.user_data['pay_amount']} so'm\n\nChekni (rasm/fayl) yuboring:",
+        f"💳 Karta: <code>{card_number}</code>\n👤 Egasi: {card_holder}\nSumma: {context.user_data['pay_amount']} so'm\n\nChekni (rasm/fayl) yuboring:",
         parse_mode="HTML"
     )
     return PAYMENT_CHECK
@@ -471,13 +462,7 @@ async def payment_check_handler(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("Chek yuboring!")
         return PAYMENT_CHECK
 
-    conn = db.get_connection()
-    c = conn.cursor()
-    c.execute("INSERT INTO pending_payments (user_id, username, full_name, months, amount, check_file_id, check_type, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, 'pending', datetime('now'))",
-              (u.id, u.username, u.full_name, context.user_data["pay_months"], context.user_data["pay_amount"], fid, ftype))
-    pid = c.lastrowid
-    conn.commit()
-    conn.close()
+    pid = await db.aadd_pending_payment(u.id, u.username, u.full_name, context.user_data["pay_months"], context.user_data["pay_amount"], fid, ftype)
 
     kb = InlineKeyboardMarkup([[InlineKeyboardButton("✅ Tasdiqlash", callback_data=f"pay_app_{pid}"), InlineKeyboardButton("❌ Rad etish", callback_data=f"pay_rej_{pid}")]])
     cap = f"💳 Chek: {u.full_name} | {context.user_data['pay_months']} oy | {context.user_data['pay_amount']} so'm"
@@ -490,7 +475,7 @@ async def payment_check_handler(update: Update, context: ContextTypes.DEFAULT_TY
     return ConversationHandler.END
     # Kino Qo'shish (/add Conversation)
 async def add_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not db.is_admin(update.effective_user.id, MAIN_ADMIN):
+    if not await db.ais_admin(update.effective_user.id, MAIN_ADMIN):
         return ConversationHandler.END
     kb = InlineKeyboardMarkup([[InlineKeyboardButton("🔢 Avto Kod", callback_data="c_auto"), InlineKeyboardButton("✍️ Qo'lda", callback_data="c_man")]])
     await update.message.reply_text("Kino kodi turi:", reply_markup=kb)
@@ -500,7 +485,7 @@ async def add_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     if q.data == "c_auto":
-        context.user_data["code"] = db.get_next_movie_code()
+        context.user_data["code"] = await db.aget_next_movie_code()
         await q.edit_message_text(f"Kod: {context.user_data['code']}\nQism raqami (masalan 1):")
         return ADD_PART
     await q.edit_message_text("Kino kodini yozing:")
@@ -550,36 +535,27 @@ async def add_rating_finish(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         r = 5.0
     ud = context.user_data
-    db.add_movie(ud["code"], ud["name"], ud["quality"], ud["year"], ud["lang"], r, ud["fid"], ud["part"])
+    await db.aadd_movie(ud["code"], ud["name"], ud["quality"], ud["year"], ud["lang"], r, ud["fid"], ud["part"])
     await update.message.reply_text(f"🎉 <b>Kino saqlandi!</b>\nNom: {ud['name']} | Kod: <code>{ud['code']}</code> | Qism: {ud['part']}", parse_mode="HTML")
     return ConversationHandler.END
 
 # O'chirish (/delete Conversation)
 async def delete_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not db.is_admin(update.effective_user.id, MAIN_ADMIN):
+    if not await db.ais_admin(update.effective_user.id, MAIN_ADMIN):
         return ConversationHandler.END
     await update.message.reply_text("O'chiriladigan kino kodini kiriting:")
     return DELETE_MOVIE_INPUT
 
 async def delete_finish(update: Update, context: ContextTypes.DEFAULT_TYPE):
     code = update.message.text.strip()
-    conn = db.get_connection()
-    c = conn.cursor()
-    c.execute("DELETE FROM movies WHERE code = ?", (code,))
-    cnt = c.rowcount
-    conn.commit()
-    conn.close()
+    cnt = await db.adelete_movies_by_code(code)
     await update.message.reply_text(f"✅ {cnt} ta kino o'chirildi.")
     return ConversationHandler.END
 
 # Sevimlilar
 async def show_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    conn = db.get_connection()
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT m.code, m.name, m.year FROM favorites f JOIN movies m ON f.movie_code = m.code WHERE f.user_id = ?", (uid,))
-    rows = c.fetchall()
-    conn.close()
+    rows = await db.aget_favorites(uid)
     if not rows:
         await update.message.reply_text("❤️ Sevimlilar bo'sh.")
         return
@@ -587,86 +563,291 @@ async def show_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # Sync Tizimi
 async def sync_send(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not db.is_admin(update.effective_user.id, MAIN_ADMIN):
+    if not await db.ais_admin(update.effective_user.id, MAIN_ADMIN):
         return
-    conn = db.get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM movies ORDER BY id ASC")
-    movies = c.fetchall()
-    conn.close()
-    await update.message.reply_text(f"🔄 {len(movies)} ta kino uzatilmoqda...")
-    for m in movies:
-        cap = f"#KINO_SYNC\nCode: {m['code']}\nName: {m['name']}\nYear: {m['year']}\nQuality: {m['quality']}\nLang: {m['language']}\nRating: {m['rating']}\nPart: {m['part']}"
-        try:
-            await context.bot.send_video(update.effective_user.id, video=m["file_id"], caption=cap)
-            await asyncio.sleep(0.05)
-        except Exception:
-            pass
+    restart = bool(context.args) and context.args[0] == "restart"
+    msg = await catalog_sync.start_export(context.bot, update.effective_user.id, restart)
+    await update.message.reply_text(msg)
 
 async def sync_recv(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not db.is_admin(update.effective_user.id, MAIN_ADMIN):
+    if not await db.ais_admin(update.effective_user.id, MAIN_ADMIN):
         return
     cap = update.message.caption or ""
     if "#KINO_SYNC" not in cap or not update.message.video:
         return
-    data = dict(line.split(":", 1) for line in cap.split("\n") if ":" in line)
-    db.add_movie(
-        code=data.get("Code", "").strip(),
-        name=data.get("Name", "").strip(),
-        quality=data.get("Quality", "").strip(),
-        year=data.get("Year", "").strip(),
-        language=data.get("Lang", "").strip(),
-        rating=float(data.get("Rating", 5.0)),
-        file_id=update.message.video.file_id,
-        part=int(data.get("Part", 1))
-    )
-    await update.message.reply_text(f"✅ Sync qabul qilindi: {data.get('Name')}")
+    movie = catalog_sync.parse_sync_caption(cap, update.message.video.file_id)
+    await catalog_sync.ingest(context.bot, update.effective_chat.id, movie)
+
+# Katalog manifesti (JSON Lines): /manifest_export, import: .jsonl fayl #KINO_MANIFEST izohi bilan
+async def manifest_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await db.ais_admin(update.effective_user.id, MAIN_ADMIN):
+        return
+    path = f"manifest_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+    try:
+        count = await db.aexport_manifest(path)
+        with open(path, "rb") as doc:
+            await context.bot.send_document(update.effective_chat.id, document=doc, caption=f"#KINO_MANIFEST\n🎬 {count} ta qism")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+async def manifest_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await db.ais_admin(update.effective_user.id, MAIN_ADMIN):
+        return
+    path = f"manifest_import_{update.message.message_id}.jsonl"
+    try:
+        tg_file = await update.message.document.get_file()
+        await tg_file.download_to_drive(path)
+        inserted, updated = await db.aimport_manifest(path)
+        await update.message.reply_text(f"✅ Manifest import qilindi: yangi {inserted}, yangilandi {updated}")
+    except Exception as e:
+        await update.message.reply_text(f"❌ Manifest import xatosi: {e}")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+# Backupdan tiklash: #KINO_RESTORE izohli fayl (faqat bosh admin). Qismlar avval, manifest oxirida yuboriladi
+async def restore_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != MAIN_ADMIN:
+        return
+    doc = update.message.document
+    os.makedirs(RESTORE_DIR, exist_ok=True)
+    path = os.path.join(RESTORE_DIR, os.path.basename(doc.file_name or f"restore_{update.message.message_id}"))
+    tg_file = await doc.get_file()
+    await tg_file.download_to_drive(path)
+    if ".part" in os.path.basename(path):
+        await update.message.reply_text(f"🧩 Qism saqlandi: {os.path.basename(path)}")
+        return
+    msg = await update.message.reply_text("♻️ Baza tiklanmoqda...")
+    ok = await asyncio.to_thread(backup_restore.restore_from_file, path)
+    if not path.endswith(backup_restore.DELTA_SUFFIX):
+        shutil.rmtree(RESTORE_DIR, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+    if ok:
+        _member_cache.clear()
+    await msg.edit_text("✅ Baza tiklandi." if ok else "❌ Tiklash amalga oshmadi: fayl buzilgan yoki mos emas.")
+
+# /rebuild_ratings: reyting agregatlarini movie_ratings dan qayta hisoblash
+async def rebuild_ratings_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await db.ais_admin(update.effective_user.id, MAIN_ADMIN):
+        return
+    codes = await db.arebuild_rating_aggregates()
+    await update.message.reply_text(f"✅ Reytinglar qayta hisoblandi: {codes} ta kod.")
 
 # Admin Buyruqlari: /block, /unblock
 async def block_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not db.is_admin(update.effective_user.id, MAIN_ADMIN) or not context.args:
+    if not await db.ais_admin(update.effective_user.id, MAIN_ADMIN) or not context.args:
         return
     uid = int(context.args[0])
-    conn = db.get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE users SET is_blocked = 1 WHERE id = ?", (uid,))
-    conn.commit()
-    conn.close()
+    await db.aset_user_blocked(uid, True)
     await update.message.reply_text(f"⛔ User {uid} bloklandi.")
 
 async def unblock_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not db.is_admin(update.effective_user.id, MAIN_ADMIN) or not context.args:
+    if not await db.ais_admin(update.effective_user.id, MAIN_ADMIN) or not context.args:
         return
     uid = int(context.args[0])
-    conn = db.get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE users SET is_blocked = 0 WHERE id = ?", (uid,))
-    conn.commit()
-    conn.close()
+    await db.aset_user_blocked(uid, False)
     await update.message.reply_text(f"✅ User {uid} blokdan chiqarildi.")
 
+# Majburiy kanallar: /addchannel <id> <url> [nom], /delchannel <id>
+async def add_channel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await db.ais_admin(update.effective_user.id, MAIN_ADMIN) or len(context.args) < 2:
+        return
+    channel_id, channel_url = context.args[0], context.args[1]
+    channel_name = " ".join(context.args[2:]) or "Kanal"
+    await db.aadd_mandatory_channel(channel_id, channel_url, channel_name)
+    await update.message.reply_text(f"✅ Majburiy kanal qo'shildi: {channel_id}")
+
+async def del_channel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await db.ais_admin(update.effective_user.id, MAIN_ADMIN) or not context.args:
+        return
+    if await db.aremove_mandatory_channel(context.args[0]):
+        await update.message.reply_text(f"✅ Kanal o'chirildi: {context.args[0]}")
+    else:
+        await update.message.reply_text("❌ Bunday kanal yo'q.")
+
+# Ommaviy xabar: /broadcast (xabarga reply qilib), /broadcast_stop <id>
+async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await db.ais_admin(update.effective_user.id, MAIN_ADMIN):
+        return
+    src_msg = update.message.reply_to_message
+    if not src_msg:
+        await update.message.reply_text("Yuboriladigan xabarga (matn, rasm yoki video) reply qilib /broadcast yozing.")
+        return
+    progress = await update.message.reply_text("📤 <b>Xabar yuborish boshlanmoqda...</b>", parse_mode="HTML")
+    bid = await broadcast.start_broadcast(context.bot, update.effective_user.id, src_msg.chat_id, src_msg.message_id, progress.message_id)
+    await update.message.reply_text(f"Broadcast #{bid} ishga tushdi. To'xtatish: /broadcast_stop {bid}")
+
+async def broadcast_stop_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await db.ais_admin(update.effective_user.id, MAIN_ADMIN) or not context.args:
+        return
+    if await broadcast.cancel_broadcast(int(context.args[0])):
+        await update.message.reply_text(f"⛔ Broadcast #{context.args[0]} to'xtatildi.")
+    else:
+        await update.message.reply_text("❌ Bunday faol broadcast yo'q.")
+
+# Admin qo'shish/o'chirish (faqat asosiy admin): /addadmin, /deladmin
+async def add_admin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != MAIN_ADMIN or not context.args:
+        return
+    uid = int(context.args[0])
+    await db.aadd_admin(uid)
+    await update.message.reply_text(f"✅ User {uid} admin qilindi.")
+
+async def del_admin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != MAIN_ADMIN or not context.args:
+        return
+    uid = int(context.args[0])
+    if await db.aremove_admin(uid):
+        await update.message.reply_text(f"✅ User {uid} adminlikdan olindi.")
+    else:
+        await update.message.reply_text(f"❌ User {uid} admin emas.")
+
+async def admin_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if await db.ais_admin(update.effective_user.id, MAIN_ADMIN):
+        await update.message.reply_text("⚙️ <b>Admin Boshqaruv Markazi:</b>", parse_mode="HTML", reply_markup=get_admin_settings_inline())
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Bekor qilindi.", reply_markup=get_main_menu_keyboard())
     return ConversationHandler.END
 
-# Asosiy main funksiyasi
-def main():
-    db.init_db()
+async def on_startup(app):
+    await broadcast.resume_broadcasts(app.bot)
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
-    app.bot_data["MAIN_ADMIN"] = MAIN_ADMIN
+async def on_shutdown(app):
+    # Bot HTTP klienti hali ochiq bo'lishi kerak (app.shutdown dan oldin); DB buferi har holda yoziladi
+    try:
+        await broadcast.stop_all()
+        await catalog_sync.stop_all(app.bot)
+    finally:
+        db.shutdown()
+
+# HTTP yo'llar: health (hosting port tekshiruvi) va Telegram webhook
+def setup_routes(server: webserver.WebServer, app):
+    async def root(request):
+        return webserver.Response(200, "Kino Bot v2.0 Live")
+
+    async def health(request):
+        body = {"status": "ok", "mode": app.bot_data.get("BOT_MODE"), "update_queue": app.update_queue.qsize()}
+        return webserver.Response(200, json.dumps(body), "application/json")
+
+    async def telegram_webhook(request):
+        given = request.headers.get("x-telegram-bot-api-secret-token", "")
+        if not WEBHOOK_SECRET or not secrets.compare_digest(given, WEBHOOK_SECRET):
+            return webserver.Response(403, "Forbidden")
+        try:
+            update = Update.de_json(request.json(), app.bot)
+        except (ValueError, TypeError, KeyError):
+            return webserver.Response(400, "Bad Request")
+        if update is not None:
+            await app.update_queue.put(update)
+        return webserver.Response(200, "ok")
+
+    async def metrics_page(request):
+        # METRICS_TOKEN berilgan bo'lsa: Authorization: Bearer <token> yoki ?token=<token>
+        if METRICS_TOKEN:
+            given = request.headers.get("authorization", "").removeprefix("Bearer ").strip() or request.query.get("token", [""])[0]
+            if not secrets.compare_digest(given, METRICS_TOKEN):
+                return webserver.Response(401, "Unauthorized")
+        return webserver.Response(200, metrics.render(), "text/plain; version=0.0.4; charset=utf-8")
+
+    server.route("GET", "/", root)
+    server.route("GET", "/health", health)
+    server.route("GET", "/metrics", metrics_page)
+    server.route("POST", WEBHOOK_PATH, telegram_webhook)
+
+async def start_updates(app) -> str:
+    # Webhook o'rnatilmasa polling ga qaytiladi; WEBHOOK_URL siz faqat lokal POST qabul qilinadi
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            logging.warning(f"WEBHOOK_URL berilmagan: yangilanishlar faqat POST {WEBHOOK_PATH} orqali keladi")
+            return "webhook-local"
+        try:
+            await app.bot.set_webhook(
+                WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+            return "webhook"
+        except TelegramError as e:
+            logging.error(f"set_webhook xatosi, polling ga o'tiladi: {e}")
+    await app.bot.delete_webhook()
+    await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+    return "polling"
+
+async def serve(app):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
 
-    # 7 kunlik avtomatik backup
+    metrics.update_queue.func = app.update_queue.qsize
+    server = webserver.WebServer("0.0.0.0", PORT)
+    setup_routes(server, app)
+    await server.start()
+    await app.initialize()
+    await on_startup(app)
+
+    # Avtomatik backup: har soatda delta, BACKUP_FULL_EVERY deltadan keyin to'liq snapshot
     sched = AsyncIOScheduler()
-    sched.add_job(backup_restore.auto_backup_job, "interval", days=7, args=[app])
+    sched.add_job(metrics.timed_job("auto_backup", backup_restore.auto_backup_job), "interval", hours=BACKUP_INTERVAL_HOURS, args=[app])
+    # Obunalar: muddati o'tganlar belgilanadi, tugashiga oz qolganlarga eslatma
+    sched.add_job(metrics.timed_job("subscription_sweep", subscriptions.sweep_job), "interval", minutes=subscriptions.SWEEP_MINUTES,
+                  args=[app], next_run_time=datetime.datetime.now())
     sched.start()
 
+    app.bot_data["BOT_MODE"] = await start_updates(app)
+    await app.start()
+    profiler = tracing.start_profiler()
+    print(f"Kino Bot v2.0 to'liq kuch bilan ishga tushdi ({app.bot_data['BOT_MODE']}, port {server.port})...")
+    try:
+        await stop.wait()
+    finally:
+        if profiler is not None:
+            profiler.cancel()
+        await server.stop()
+        sched.shutdown(wait=False)
+        if app.updater.running:
+            await app.updater.stop()
+        await app.stop()
+        try:
+            await on_shutdown(app)
+        finally:
+            await app.shutdown()
+
+def build_application(token: str, base_url: str = ""):
+    builder = ApplicationBuilder().token(token)
+    builder = builder.request(metrics.InstrumentedRequest(connection_pool_size=256))
+    builder = builder.get_updates_request(metrics.InstrumentedRequest(connection_pool_size=1))
+    if base_url:
+        builder = builder.base_url(base_url).base_file_url(base_url)
+    # Update lar parallel (UPDATE_CONCURRENCY gacha), bitta foydalanuvchiniki esa ketma-ket
+    processor = concurrency.OrderedUpdateProcessor(max(1, concurrency.UPDATE_CONCURRENCY))
+    builder = builder.concurrent_updates(processor)
+    metrics.updates_active.func = lambda: processor.active
+    metrics.updates_waiting.func = lambda: processor.waiting
+    app = builder.build()
+    app.bot_data["MAIN_ADMIN"] = MAIN_ADMIN
+
     # Asosiy buyruqlar
     app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("settings", lambda u, c: u.message.reply_text("⚙️ <b>Admin Boshqaruv Markazi:</b>", parse_mode="HTML", reply_markup=get_admin_settings_inline()) if db.is_admin(u.effective_user.id, MAIN_ADMIN) else None))
+    app.add_handler(CommandHandler("settings", admin_settings))
     app.add_handler(CommandHandler("sync_send", sync_send))
+    app.add_handler(CommandHandler("manifest_export", manifest_export))
     app.add_handler(CommandHandler("block", block_user))
     app.add_handler(CommandHandler("unblock", unblock_user))
+    app.add_handler(CommandHandler("addadmin", add_admin_cmd))
+    app.add_handler(CommandHandler("deladmin", del_admin_cmd))
+    app.add_handler(CommandHandler("addchannel", add_channel_cmd))
+    app.add_handler(CommandHandler("delchannel", del_channel_cmd))
+    app.add_handler(CommandHandler("broadcast", broadcast_cmd))
+    app.add_handler(CommandHandler("rebuild_ratings", rebuild_ratings_cmd))
+    app.add_handler(CommandHandler("broadcast_stop", broadcast_stop_cmd))
 
     # Add Movie Conv
     app.add_handler(ConversationHandler(
@@ -693,20 +874,33 @@ def main():
     ))
 
     # Inputs Conv
-    app.add_handler(ConversationHandler(entry_points=[MessageHandler(filters.Regex("^📝 Kod yozish$"), lambda u, c: SEARCH_CODE)], states={SEARCH_CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, search_code_handler)]}, fallbacks=[CommandHandler("cancel", cancel)]))
-    app.add_handler(ConversationHandler(entry_points=[MessageHandler(filters.Regex("^🔍 Nom yozish$"), lambda u, c: SEARCH_NAME)], states={SEARCH_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, search_name_handler)]}, fallbacks=[CommandHandler("cancel", cancel)]))
-    app.add_handler(ConversationHandler(entry_points=[MessageHandler(filters.Regex("^💬 Taklif yuborish$"), lambda u, c: SEND_OFFER)], states={SEND_OFFER: [MessageHandler(filters.TEXT & ~filters.COMMAND, offer_handler)]}, fallbacks=[CommandHandler("cancel", cancel)]))
-    app.add_handler(ConversationHandler(entry_points=[MessageHandler(filters.Regex("^🆘 Adminga murojaat$"), lambda u, c: SEND_ADMIN_MSG)], states={SEND_ADMIN_MSG: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_msg_handler)]}, fallbacks=[CommandHandler("cancel", cancel)]))
-    app.add_handler(ConversationHandler(entry_points=[MessageHandler(filters.Regex("^🎟️ Promo-kod kiritish$"), lambda u, c: PROMO_INPUT)], states={PROMO_INPUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, promo_input_handler)]}, fallbacks=[CommandHandler("cancel", cancel)]))
+    app.add_handler(ConversationHandler(entry_points=[MessageHandler(filters.Regex("^📝 Kod yozish$"), menu_router)], states={SEARCH_CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, search_code_handler)]}, fallbacks=[CommandHandler("cancel", cancel)]))
+    app.add_handler(ConversationHandler(entry_points=[MessageHandler(filters.Regex("^🔍 Nom yozish$"), menu_router)], states={SEARCH_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, search_name_handler)]}, fallbacks=[CommandHandler("cancel", cancel)]))
+    app.add_handler(ConversationHandler(entry_points=[MessageHandler(filters.Regex("^💬 Taklif yuborish$"), menu_router)], states={SEND_OFFER: [MessageHandler(filters.TEXT & ~filters.COMMAND, offer_handler)]}, fallbacks=[CommandHandler("cancel", cancel)]))
+    app.add_handler(ConversationHandler(entry_points=[MessageHandler(filters.Regex("^🆘 Adminga murojaat$"), menu_router)], states={SEND_ADMIN_MSG: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_msg_handler)]}, fallbacks=[CommandHandler("cancel", cancel)]))
+    app.add_handler(ConversationHandler(entry_points=[MessageHandler(filters.Regex("^🎟️ Promo-kod kiritish$"), menu_router)], states={PROMO_INPUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, promo_input_handler)]}, fallbacks=[CommandHandler("cancel", cancel)]))
     app.add_handler(ConversationHandler(entry_points=[CallbackQueryHandler(plan_callback, pattern="^buy_")], states={PAYMENT_CHECK: [MessageHandler(filters.PHOTO | filters.Document.ALL, payment_check_handler)]}, fallbacks=[CommandHandler("cancel", cancel)]))
 
     # Router va Sync Handlerlar
     app.add_handler(CallbackQueryHandler(global_callback_router))
     app.add_handler(MessageHandler(filters.VIDEO & filters.CaptionRegex("#KINO_SYNC"), sync_recv))
+    app.add_handler(MessageHandler(filters.Document.FileExtension("jsonl") & filters.CaptionRegex("#KINO_MANIFEST"), manifest_import))
+    app.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex("#KINO_RESTORE"), restore_upload))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, menu_router))
+    for group in app.handlers.values():
+        metrics.instrument_handlers(group)
+        # TRACE_UPDATES=1: har update uchun handler/DB/API vaqtlari logga yoziladi
+        if tracing.TRACE_UPDATES:
+            metrics.instrument_handlers(group, tracing.trace_handler, "__trace_wrapped__")
+    return app
 
-    print("Kino Bot v2.0 to'liq kuch bilan ishga tushdi...")
-    app.run_polling()
+# Asosiy main funksiyasi
+def main():
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        raise SystemExit("BOT_MODE=webhook uchun WEBHOOK_SECRET berilishi shart (barcha instansiyalarda bir xil qiymat)")
+    db.init_db()
+    db.load_catalog()
+    asyncio.run(serve(build_application(BOT_TOKEN, os.getenv("TELEGRAM_API_URL", ""))))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,202 @@
+import time
+import bisect
+import functools
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from telegram.request import HTTPXRequest
+
+import tracing
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+JOB_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0)
+
+_registry: List["_Metric"] = []
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+# Prometheus matn formatidagi metrikalar: thread-safe, executor threadlaridan ham yoziladi
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in items]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, func: Optional[Callable[[], float]] = None):
+        super().__init__(name, help)
+        self.func = func
+
+    def render(self) -> List[str]:
+        if self.func is None:
+            return []
+        try:
+            value = self.func()
+        except Exception:
+            return []
+        return self._header() + [f"{self.name} {value}"]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, *labels: str):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(labels)
+            if v is None:
+                v = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            v[0][i] += 1
+            v[1] += value
+            v[2] += 1
+
+    def totals(self, *labels: str) -> Tuple[int, float]:
+        # (kuzatuvlar soni, yig'indi); label berilmasa barcha seriyalar bo'yicha
+        with self._lock:
+            series = [self._values[labels]] if labels in self._values else [] if labels or not self.labelnames else list(self._values.values())
+            return sum(v[2] for v in series), sum(v[1] for v in series)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, [list(v[0]), v[1], v[2]]) for k, v in self._values.items())
+        lines = self._header()
+        for labels, (counts, total, n) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                le = _labels(self.labelnames, labels, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {n}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {n}")
+        return lines
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+handler_seconds = Histogram("kino_handler_seconds", "Handler bajarilish vaqti", ("handler",))
+handler_errors = Counter("kino_handler_errors_total", "Handlerda ko'tarilgan xatolar", ("handler",))
+db_calls = Counter("kino_db_calls_total", "db executor chaqiruvlari", ("func",))
+db_errors = Counter("kino_db_errors_total", "db funksiyalaridagi xatolar", ("func",))
+db_seconds = Histogram("kino_db_call_seconds", "db funksiyasining threadda bajarilish vaqti", ("func",), DB_BUCKETS)
+db_wait_seconds = Histogram("kino_db_executor_wait_seconds", "db executor navbatida kutish", (), DB_BUCKETS)
+db_pool_wait_seconds = Histogram("kino_db_pool_wait_seconds", "DB ulanishlar pulidan ulanish olishni kutish", (), DB_BUCKETS)
+api_calls = Counter("kino_bot_api_requests_total", "Bot API so'rovlari", ("method", "status"))
+api_errors = Counter("kino_bot_api_errors_total", "Bot API xatolari (4xx/5xx va tarmoq)", ("method",))
+api_retry_after = Counter("kino_bot_api_retry_after_total", "Bot API RetryAfter (429) javoblari", ("method",))
+api_seconds = Histogram("kino_bot_api_seconds", "Bot API so'rov vaqti", ("method",))
+job_seconds = Histogram("kino_scheduler_job_seconds", "Scheduler vazifalari davomiyligi", ("job",), JOB_BUCKETS)
+job_failures = Counter("kino_scheduler_job_failures_total", "Scheduler vazifalaridagi xatolar", ("job",))
+update_queue = Gauge("kino_update_queue_depth", "Qayta ishlanmagan yangilanishlar navbati")
+updates_active = Gauge("kino_updates_active", "Hozir qayta ishlanayotgan foydalanuvchilar (tartib kalitlari)")
+updates_waiting = Gauge("kino_updates_waiting", "O'z foydalanuvchisining oldingi update ini kutayotganlar")
+
+def track_handler(func, name: Optional[str] = None):
+    name = name or func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, name)
+    wrapper.__metrics_wrapped__ = True
+    return wrapper
+
+def instrument_handlers(handlers, wrap=track_handler, marker: str = "__metrics_wrapped__"):
+    # Application handlerlari (ConversationHandler holatlari bilan) berilgan o'ramga o'raladi
+    for h in handlers:
+        nested = getattr(h, "entry_points", None)
+        if nested is not None:
+            instrument_handlers(h.entry_points, wrap, marker)
+            for state_handlers in h.states.values():
+                instrument_handlers(state_handlers, wrap, marker)
+            instrument_handlers(h.fallbacks, wrap, marker)
+            continue
+        cb = getattr(h, "callback", None)
+        if cb is None or getattr(cb, marker, False) or cb.__name__ == "<lambda>":
+            continue
+        h.callback = wrap(cb)
+
+def timed_job(name: str, func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            job_failures.inc(name)
+            raise
+        finally:
+            job_seconds.observe(time.perf_counter() - start, name)
+    return wrapper
+
+class InstrumentedRequest(HTTPXRequest):
+    # Har bir Bot API chaqiruvi: metod, HTTP status, vaqt; 429 = RetryAfter
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            api_calls.inc(api_method, "error")
+            api_errors.inc(api_method)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            api_seconds.observe(elapsed, api_method)
+            span = tracing.current_span()
+            if span is not None:
+                span.api += elapsed
+                span.api_calls += 1
+        api_calls.inc(api_method, str(code))
+        if code == 429:
+            api_retry_after.inc(api_method)
+        if code >= 400:
+            api_errors.inc(api_method)
+        return code, payload
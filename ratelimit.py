@@ -0,0 +1,47 @@
+import time
+import asyncio
+from typing import Optional
+
+# Token bucket: Bot API chegaralaridan oshmaslik uchun umumiy tezlik cheklovchi
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        # RetryAfter: barcha yuboruvchilar ko'rsatilgan vaqtgacha to'xtaydi
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+# Moslashuvchan bucket: RetryAfter bo'lsa tezlik kamayadi, muvaffaqiyatli yuborishlarda asta oshadi
+class AdaptiveTokenBucket(TokenBucket):
+    def __init__(self, rate: float, min_rate: float = 1.0, max_rate: Optional[float] = None, step: float = 0.1):
+        super().__init__(rate, capacity=1)
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate
+        self.step = step
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.step)
+
+    def on_retry_after(self, seconds: float):
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.pause(seconds)
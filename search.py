@@ -0,0 +1,140 @@
+import math
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Set
+
+# O'zbek kirill -> lotin transliteratsiyasi
+_CYR_TO_LAT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "ғ": "g'", "д": "d", "е": "e", "ё": "yo",
+    "ж": "j", "з": "z", "и": "i", "й": "y", "к": "k", "қ": "q", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ў": "o'",
+    "ф": "f", "х": "x", "ҳ": "h", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "'",
+    "ь": "", "ы": "i", "э": "e", "ю": "yu", "я": "ya",
+}
+_APOSTROPHES = "'`ʻʼ’‘´"
+MIN_CONTAINMENT = 0.5
+
+def normalize(text: str) -> str:
+    text = text.lower()
+    out = []
+    for i, ch in enumerate(text):
+        lat = _CYR_TO_LAT.get(ch)
+        if lat is None:
+            out.append(ch)
+        elif ch == "е" and (i == 0 or not text[i - 1].isalpha()):
+            out.append("ye")
+        else:
+            out.append(lat)
+    text = unicodedata.normalize("NFKD", "".join(out))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch) and ch not in _APOSTROPHES)
+    text = "".join(ch if ch.isalnum() else " " for ch in text)
+    return " ".join(text.split())
+
+def trigrams(norm: str) -> Set[str]:
+    grams = set()
+    for word in norm.split():
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class MovieEntry:
+    __slots__ = ("code", "name", "year", "quality", "language", "rating", "popularity", "norm", "tokens", "grams")
+
+    def __init__(self, code: str, name: str, year: str, quality: str, language: str, rating: float, popularity: int):
+        self.code = code
+        self.name = name
+        self.year = year
+        self.quality = quality
+        self.language = language
+        self.rating = rating
+        self.popularity = popularity
+        self.norm = normalize(name or "")
+        self.tokens = self.norm.split()
+        self.grams = trigrams(self.norm)
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+# Nom bo'yicha qidiruv indeksi: trigram + prefiks moslik, mashhurlik bo'yicha saralash
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, MovieEntry] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self.loaded = False
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._postings = {}
+            self.loaded = False
+
+    def _remove(self, code: str):
+        entry = self._entries.pop(code, None)
+        if entry is None:
+            return
+        for g in entry.grams:
+            codes = self._postings.get(g)
+            if codes is not None:
+                codes.discard(code)
+                if not codes:
+                    del self._postings[g]
+
+    def add(self, code: str, name: str, year: str = "", quality: str = "", language: str = "", rating: float = 5.0, popularity: int = 0):
+        entry = MovieEntry(code, name, year, quality, language, rating, popularity)
+        with self._lock:
+            old = self._entries.get(code)
+            if old is not None:
+                entry.popularity = max(entry.popularity, old.popularity)
+            self._remove(code)
+            self._entries[code] = entry
+            for g in entry.grams:
+                self._postings.setdefault(g, set()).add(code)
+
+    def remove(self, code: str):
+        with self._lock:
+            self._remove(code)
+
+    def bump(self, code: str, n: int = 1):
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is not None:
+                entry.popularity += n
+
+    def set_rating(self, code: str, rating: float):
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is not None:
+                entry.rating = rating
+
+    def search(self, query: str, limit: int = 15) -> List[MovieEntry]:
+        norm = normalize(query)
+        if not norm:
+            return []
+        q_tokens = norm.split()
+        q_grams = trigrams(norm)
+        with self._lock:
+            shared = Counter()
+            for g in q_grams:
+                for code in self._postings.get(g, ()):
+                    shared[code] += 1
+            candidates = [(self._entries[code], n) for code, n in shared.items()]
+        if not candidates:
+            return []
+        max_pop = max(e.popularity for e, _ in candidates)
+        scored = []
+        for entry, n in candidates:
+            containment = n / len(q_grams)
+            jaccard = n / (len(q_grams) + len(entry.grams) - n)
+            prefix = sum(1 for t in q_tokens if any(w.startswith(t) for w in entry.tokens)) / len(q_tokens)
+            substring = norm in entry.norm
+            if containment < MIN_CONTAINMENT and not prefix and not substring:
+                continue
+            exact = sum(1 for t in q_tokens if t in entry.tokens) / len(q_tokens)
+            score = 0.7 * containment + 0.3 * jaccard + prefix + 0.2 * exact + (0.5 if substring else 0)
+            if max_pop:
+                score += 0.3 * math.log1p(entry.popularity) / math.log1p(max_pop)
+            scored.append((score, entry))
+        scored.sort(key=lambda s: s[0], reverse=True)
+        return [entry for _, entry in scored[:limit]]
@@ -0,0 +1,76 @@
+import os
+import logging
+from typing import List
+
+from telegram.error import RetryAfter, Forbidden, BadRequest, TelegramError
+
+import db
+import timeutil
+from ratelimit import TokenBucket
+
+SWEEP_MINUTES = float(os.getenv("SUB_SWEEP_MINUTES", "15"))
+SWEEP_BATCH = int(os.getenv("SUB_SWEEP_BATCH", "500"))
+SWEEP_MAX_BATCHES = int(os.getenv("SUB_SWEEP_MAX_BATCHES", "40"))
+REMIND_DAYS = sorted({int(d) for d in os.getenv("SUB_REMIND_DAYS", "3,1").split(",") if d.strip()})
+REMIND_RATE = float(os.getenv("SUB_REMIND_RATE", "10"))
+REMIND_MAX = int(os.getenv("SUB_REMIND_MAX", "1000"))
+REMIND_BATCH = 100
+MAX_RETRIES = 3
+
+logger = logging.getLogger(__name__)
+
+# Eslatmalar alohida, broadcast dan sekinroq bucket orqali yuboriladi
+bucket = TokenBucket(REMIND_RATE)
+
+async def expire_batches() -> int:
+    # Har ishga tushishda ko'pi bilan SWEEP_MAX_BATCHES partiya: qolgani keyingi safar
+    expired = 0
+    for _ in range(SWEEP_MAX_BATCHES):
+        count, _ = await db.aexpire_subscriptions(SWEEP_BATCH)
+        expired += count
+        if count < SWEEP_BATCH:
+            break
+    return expired
+
+async def _send(bot, user_id: int, text: str) -> bool:
+    # False: foydalanuvchiga yetkazib bo'lmaydi (bloklagan), qayta urinilmaydi
+    for _ in range(MAX_RETRIES):
+        await bucket.acquire()
+        try:
+            await bot.send_message(user_id, text, parse_mode="HTML")
+            return True
+        except RetryAfter as e:
+            bucket.pause(e.retry_after)
+        except (Forbidden, BadRequest):
+            return False
+        except TelegramError as e:
+            logger.warning(f"Obuna eslatmasi {user_id}: {e}")
+            return False
+    return False
+
+async def send_reminders(bot) -> int:
+    # Kichik chegaradan boshlanadi: 1 kun qolganga avval 3 kunlik eslatma yuborilmaydi
+    sent = processed = 0
+    for days in REMIND_DAYS:
+        while processed < REMIND_MAX:
+            rows = await db.aget_expiring_subscriptions(days, min(REMIND_BATCH, REMIND_MAX - processed))
+            if not rows:
+                break
+            done: List[int] = []
+            for r in rows:
+                text = (
+                    f"⏰ <b>Obunangiz {max(1, timeutil.days_left(r['end_date']))} kundan keyin tugaydi</b> ({timeutil.fmt(r['end_date'])}).\n"
+                    f"💳 OBUNA bo'limidan muddatni uzaytirishingiz mumkin."
+                )
+                if await _send(bot, r["user_id"], text):
+                    sent += 1
+                done.append(r["id"])
+            processed += len(done)
+            await db.amark_subscriptions_reminded(done, days)
+    return sent
+
+async def sweep_job(app):
+    expired = await expire_batches()
+    reminded = await send_reminders(app.bot) if REMIND_DAYS else 0
+    if expired or reminded:
+        logger.info(f"Obunalar: {expired} ta muddati tugadi, {reminded} ta eslatma yuborildi")
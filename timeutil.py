@@ -0,0 +1,32 @@
+import time
+import datetime
+from typing import Optional
+
+# Vaqt DB da butun son (epoch soniya, UTC) sifatida saqlanadi; mahalliy vaqt faqat ko'rsatish va kunlik kalitlar uchun
+DAY = 86400
+
+def now() -> int:
+    return int(time.time())
+
+def days(n: float) -> int:
+    return int(n * DAY)
+
+def fmt(ts: Optional[int], pattern: str = "%Y-%m-%d %H:%M") -> str:
+    if ts is None:
+        return ""
+    return time.strftime(pattern, time.localtime(ts))
+
+def local_day(ts: Optional[int] = None, offset_days: int = 0) -> str:
+    # stats_daily kaliti: mahalliy sana "YYYY-MM-DD"
+    day = datetime.date.fromtimestamp(ts) if ts is not None else datetime.date.today()
+    return (day + datetime.timedelta(days=offset_days)).isoformat()
+
+def days_left(ts: int) -> int:
+    return max(0, -(-(ts - now()) // DAY))
+
+# SQLite ifodalari: eski TEXT sanalarni epoch ga o'tkazish (migratsiya uchun)
+def sql_from_local(column: str) -> str:
+    return f"CAST(strftime('%s', {column}, 'utc') AS INTEGER)"
+
+def sql_from_utc(column: str) -> str:
+    return f"CAST(strftime('%s', {column}) AS INTEGER)"
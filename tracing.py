@@ -0,0 +1,131 @@
+import os
+import time
+import asyncio
+import cProfile
+import logging
+import sqlite3
+import functools
+import contextvars
+from typing import Optional
+
+TRACE_UPDATES = os.getenv("TRACE_UPDATES", "0") == "1"
+TRACE_MIN_MS = float(os.getenv("TRACE_MIN_MS", "0"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0"))
+PROFILE_DURATION = float(os.getenv("PROFILE_DURATION", "10"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "24"))
+
+logger = logging.getLogger("kino.trace")
+
+# Bitta update uchun span: handler, DB va Bot API vaqtlari
+class Span:
+    __slots__ = ("handler", "update_id", "user_id", "start", "db", "db_calls", "api", "api_calls")
+
+    def __init__(self, handler: str, update_id: Optional[int], user_id: Optional[int]):
+        self.handler = handler
+        self.update_id = update_id
+        self.user_id = user_id
+        self.start = time.perf_counter()
+        self.db = 0.0
+        self.db_calls = 0
+        self.api = 0.0
+        self.api_calls = 0
+
+_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("kino_span", default=None)
+
+def current_span() -> Optional[Span]:
+    return _span.get()
+
+def trace_handler(func):
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(update, context, *args, **kwargs):
+        if _span.get() is not None:
+            return await func(update, context, *args, **kwargs)
+        user = getattr(update, "effective_user", None)
+        span = Span(name, getattr(update, "update_id", None), user.id if user else None)
+        token = _span.set(span)
+        try:
+            return await func(update, context, *args, **kwargs)
+        finally:
+            _span.reset(token)
+            total = (time.perf_counter() - span.start) * 1000
+            if total >= TRACE_MIN_MS:
+                logger.info(
+                    f"update={span.update_id} user={span.user_id} handler={span.handler} total={total:.1f}ms "
+                    f"db={span.db * 1000:.1f}ms/{span.db_calls} api={span.api * 1000:.1f}ms/{span.api_calls} "
+                    f"other={total - (span.db + span.api) * 1000:.1f}ms"
+                )
+    wrapper.__trace_wrapped__ = True
+    return wrapper
+
+# Sekin so'rovlar: SLOW_QUERY_MS > 0 bo'lsa ulanishlar shu klass bilan ochiladi
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+def _log_slow(conn: sqlite3.Connection, sql: str, params, elapsed: float):
+    plan = ""
+    if sql.lstrip().upper().startswith(_EXPLAINABLE):
+        try:
+            rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params or ()).fetchall()
+            plan = "\n".join(f"  {r[0]}|{r[1]}| {r[3]}" for r in rows)
+        except sqlite3.Error as e:
+            plan = f"  (plan olinmadi: {e})"
+    logger.warning(f"slow query {elapsed * 1000:.1f}ms: {' '.join(sql.split())}\n{plan}")
+
+class TracedCursor(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            elapsed = time.perf_counter() - start
+            if elapsed * 1000 >= SLOW_QUERY_MS:
+                _log_slow(self.connection, sql, params, elapsed)
+
+    def executemany(self, sql, seq_of_params):
+        seq = list(seq_of_params)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq)
+        finally:
+            elapsed = time.perf_counter() - start
+            if elapsed * 1000 >= SLOW_QUERY_MS:
+                _log_slow(self.connection, f"{sql} -- x{len(seq)}", seq[0] if seq else (), elapsed)
+
+class TracedConnection(sqlite3.Connection):
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+def connection_factory():
+    return TracedConnection if SLOW_QUERY_MS > 0 else sqlite3.Connection
+
+# Profiler: har PROFILE_INTERVAL soniyada PROFILE_DURATION soniyalik cProfile oynasi (event loop threadi)
+async def _profile_loop():
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    while True:
+        await asyncio.sleep(PROFILE_INTERVAL)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(PROFILE_DURATION)
+        finally:
+            profiler.disable()
+        path = os.path.join(PROFILE_DIR, f"profile_{time.strftime('%Y%m%d_%H%M%S')}.prof")
+        profiler.dump_stats(path)
+        logger.info(f"profil yozildi: {path}")
+        dumps = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith(".prof"))
+        for old in dumps[:-PROFILE_KEEP]:
+            os.remove(os.path.join(PROFILE_DIR, old))
+
+def start_profiler() -> Optional[asyncio.Task]:
+    if PROFILE_INTERVAL <= 0:
+        return None
+    return asyncio.create_task(_profile_loop())
@@ -0,0 +1,128 @@
+import json
+import asyncio
+import logging
+from http import HTTPStatus
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+MAX_BODY = 2 * 1024 * 1024
+READ_TIMEOUT = 30
+
+logger = logging.getLogger(__name__)
+
+class Request:
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method: str, path: str, query: Dict[str, list], headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body or b"null")
+
+class Response:
+    __slots__ = ("status", "body", "content_type")
+
+    def __init__(self, status: int = 200, body=b"", content_type: str = "text/plain; charset=utf-8"):
+        if isinstance(body, str):
+            body = body.encode()
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+# Asyncio ustidagi kichik HTTP/1.1 server: webhook, health va boshqa xizmat yo'llari bitta PORT da
+class WebServer:
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._clients: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    def route(self, method: str, path: str, handler: Handler):
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"HTTP server {self.host}:{self.port} da ishga tushdi")
+
+    async def stop(self):
+        # Keep-alive ulanishlar ham yopiladi, aks holda wait_closed ularni kutib qoladi
+        if self._server is not None:
+            self._server.close()
+            clients = list(self._clients.items())
+            for _, writer in clients:
+                writer.close()
+            await asyncio.gather(*(task for task, _ in clients), return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+        if not line:
+            return None
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            h = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+            if h in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = h.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY:
+            raise ValueError("body too large")
+        body = await asyncio.wait_for(reader.readexactly(length), READ_TIMEOUT) if length else b""
+        url = urlsplit(target)
+        return Request(method.upper(), url.path, parse_qs(url.query), headers, body)
+
+    async def _dispatch(self, request: Request) -> Response:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                return Response(405, "Method Not Allowed")
+            return Response(404, "Not Found")
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"HTTP {request.method} {request.path} xatosi: {e}")
+            return Response(500, "Internal Server Error")
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._clients[asyncio.current_task()] = writer
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    request, response = None, Response(400, "Bad Request")
+                else:
+                    if request is None:
+                        break
+                    response = await self._dispatch(request)
+                keep_alive = request is not None and request.headers.get("connection", "").lower() != "close"
+                head = (
+                    f"HTTP/1.1 {response.status} {HTTPStatus(response.status).phrase}\r\n"
+                    f"Content-Type: {response.content_type}\r\n"
+                    f"Content-Length: {len(response.body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                )
+                writer.write(head.encode("latin-1") + response.body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            self._clients.pop(asyncio.current_task(), None)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass